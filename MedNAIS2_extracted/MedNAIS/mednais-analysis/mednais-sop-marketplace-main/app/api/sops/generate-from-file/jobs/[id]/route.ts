@@ -0,0 +1,35 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+export const dynamic = 'force-dynamic';
+
+// Status of a background SOP generation job queued by generate-from-file
+export async function GET(
+  request: NextRequest,
+  { params }: { params: { id: string } }
+) {
+  const workerUrl = process.env.DOCUMENT_WORKER_URL;
+
+  if (!workerUrl) {
+    return NextResponse.json(
+      { error: 'Document worker is not configured' },
+      { status: 404 }
+    );
+  }
+
+  try {
+    const response = await fetch(`${workerUrl}/jobs/${encodeURIComponent(params.id)}`, {
+      cache: 'no-store',
+    });
+    const data = await response.json();
+    return NextResponse.json(data, { status: response.status });
+  } catch (error) {
+    console.error('Error fetching document job status:', error);
+    return NextResponse.json(
+      {
+        error: 'Failed to fetch job status',
+        details: error instanceof Error ? error.message : 'Unknown error'
+      },
+      { status: 502 }
+    );
+  }
+}
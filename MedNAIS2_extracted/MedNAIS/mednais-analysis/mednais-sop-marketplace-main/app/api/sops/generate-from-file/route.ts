@@ -2,6 +2,8 @@ import { NextRequest, NextResponse } from 'next/server';
 import { writeFile, unlink } from 'fs/promises';
 import { join } from 'path';
 import { spawn } from 'child_process';
+import { getCurrentUser } from '@/lib/auth/server';
+import { prisma } from '@/lib/db';
 
 // Next.js 14 App Router config
 export const runtime = 'nodejs';
@@ -11,6 +13,7 @@ export async function POST(request: NextRequest) {
     const formData = await request.formData();
     const file = formData.get('file') as File;
     const customPrompt = formData.get('customPrompt') as string;
+    const runAsync = formData.get('async') === 'true';
     
     if (!file) {
       return NextResponse.json(
@@ -27,6 +30,19 @@ export async function POST(request: NextRequest) {
 
     console.log(`📄 File uploaded: ${file.name} (${file.type})`);
     
+    // Queue a background job when the caller can poll for the result;
+    // the job owns the temp file from here on
+    const workerUrl = process.env.DOCUMENT_WORKER_URL;
+    const priority = workerUrl ? await getGenerationPriority() : 'normal';
+    if (runAsync && workerUrl) {
+      try {
+        const job = await submitWorkerJob(workerUrl, tempFilePath, file.type, customPrompt, priority);
+        return NextResponse.json({ success: true, jobId: job.job_id, status: job.status }, { status: 202 });
+      } catch (err) {
+        console.error('Could not queue document job, processing inline:', err);
+      }
+    }
+
     // Save custom prompt to temp file if provided
     let promptFilePath = '';
     if (customPrompt) {
@@ -34,55 +50,31 @@ export async function POST(request: NextRequest) {
       await writeFile(promptFilePath, customPrompt);
     }
 
-    // Call Python script to process file with GPT-5
-    const result = await new Promise<string>((resolve, reject) => {
-      const args = [
-        join(process.cwd(), 'scripts', 'process_document.py'),
-        tempFilePath,
-        file.type || 'application/octet-stream'
-      ];
-      
-      if (promptFilePath) {
-        args.push(promptFilePath);
-      }
-      
-      // Use virtual environment python
-      const pythonPath = process.env.PYTHON_PATH || '/root/.venv/bin/python';
-      const python = spawn(pythonPath, args);
-
-      let output = '';
-      let errorOutput = '';
-
-      python.stdout.on('data', (data) => {
-        output += data.toString();
-      });
-
-      python.stderr.on('data', (data) => {
-        errorOutput += data.toString();
-        console.error('Python stderr:', data.toString());
-      });
-
-      python.on('close', async (code) => {
-        // Clean up temp files
+    // Generate steps with the warm document worker when configured,
+    // falling back to spawning the Python script
+    let steps;
+    try {
+      if (workerUrl) {
         try {
-          await unlink(tempFilePath);
-          if (promptFilePath) {
-            await unlink(promptFilePath);
-          }
+          steps = await generateWithWorker(workerUrl, tempFilePath, file.type, customPrompt, priority);
         } catch (err) {
-          console.error('Error deleting temp file:', err);
+          console.error('Document worker unavailable, spawning script:', err);
         }
-
-        if (code !== 0) {
-          reject(new Error(`Python script failed: ${errorOutput}`));
-        } else {
-          resolve(output);
+      }
+      if (!steps) {
+        steps = await generateWithScript(tempFilePath, file.type, promptFilePath);
+      }
+    } finally {
+      // Clean up temp files
+      try {
+        await unlink(tempFilePath);
+        if (promptFilePath) {
+          await unlink(promptFilePath);
         }
-      });
-    });
-
-    // Parse JSON response from Python script
-    const steps = JSON.parse(result);
+      } catch (err) {
+        console.error('Error deleting temp file:', err);
+      }
+    }
 
     return NextResponse.json({
       success: true,
@@ -100,3 +92,118 @@ export async function POST(request: NextRequest) {
     );
   }
 }
+
+type GenerationPriority = 'high' | 'normal';
+
+// Creators with paid sales get their generations scheduled ahead of others
+async function getGenerationPriority(): Promise<GenerationPriority> {
+  try {
+    const user = await getCurrentUser();
+    if (!user) {
+      return 'normal';
+    }
+
+    const paidSale = await prisma.purchase.findFirst({
+      where: { sellerId: user.id, price: { gt: 0 } },
+      select: { id: true },
+    });
+    return paidSale ? 'high' : 'normal';
+  } catch (error) {
+    console.error('Could not determine generation priority:', error);
+    return 'normal';
+  }
+}
+
+async function generateWithWorker(
+  workerUrl: string,
+  filePath: string,
+  mimeType: string,
+  customPrompt: string | null,
+  priority: GenerationPriority
+) {
+  const response = await fetch(`${workerUrl}/generate`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      file_path: filePath,
+      mime_type: mimeType || 'application/octet-stream',
+      custom_prompt: customPrompt || null,
+      priority,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`Document worker returned ${response.status}`);
+  }
+
+  const data = await response.json();
+  return data.steps;
+}
+
+async function submitWorkerJob(
+  workerUrl: string,
+  filePath: string,
+  mimeType: string,
+  customPrompt: string | null,
+  priority: GenerationPriority
+) {
+  const response = await fetch(`${workerUrl}/jobs`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      file_path: filePath,
+      mime_type: mimeType || 'application/octet-stream',
+      custom_prompt: customPrompt || null,
+      delete_file: true,
+      priority,
+    }),
+  });
+
+  if (response.status !== 202) {
+    throw new Error(`Document worker returned ${response.status}`);
+  }
+
+  return response.json();
+}
+
+async function generateWithScript(filePath: string, mimeType: string, promptFilePath: string) {
+  // Call Python script to process file with GPT-5
+  const result = await new Promise<string>((resolve, reject) => {
+    const args = [
+      join(process.cwd(), 'scripts', 'process_document.py'),
+      filePath,
+      mimeType || 'application/octet-stream'
+    ];
+
+    if (promptFilePath) {
+      args.push(promptFilePath);
+    }
+
+    // Use virtual environment python
+    const pythonPath = process.env.PYTHON_PATH || '/root/.venv/bin/python';
+    const python = spawn(pythonPath, args);
+
+    let output = '';
+    let errorOutput = '';
+
+    python.stdout.on('data', (data) => {
+      output += data.toString();
+    });
+
+    python.stderr.on('data', (data) => {
+      errorOutput += data.toString();
+      console.error('Python stderr:', data.toString());
+    });
+
+    python.on('close', (code) => {
+      if (code !== 0) {
+        reject(new Error(`Python script failed: ${errorOutput}`));
+      } else {
+        resolve(output);
+      }
+    });
+  });
+
+  // Parse JSON response from Python script
+  return JSON.parse(result);
+}
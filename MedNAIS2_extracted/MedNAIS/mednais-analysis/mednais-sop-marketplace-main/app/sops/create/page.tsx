@@ -49,6 +49,39 @@ interface SOPFormData {
   categoryId?: string;
 }
 
+const JOB_POLL_INTERVAL_MS = 1500;
+// Covers time spent queued plus the worker's own job timeout
+const JOB_MAX_WAIT_MS = 15 * 60 * 1000;
+
+const JOB_STAGE_LABELS: Record<string, string> = {
+  queued: 'Waiting for a free worker...',
+  extracting: 'Reading document...',
+  generating: 'Generating steps with AI...',
+};
+
+// Poll a background generation job until it finishes and return its steps
+async function waitForGenerationJob(
+  jobId: string,
+  onStatus: (status: string, partialSteps: any[]) => void
+) {
+  const deadline = Date.now() + JOB_MAX_WAIT_MS;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+
+    const response = await fetch(`/api/sops/generate-from-file/jobs/${jobId}`, { cache: 'no-store' });
+    if (!response.ok) {
+      throw new Error('Lost track of the SOP generation job');
+    }
+
+    const job = await response.json();
+    if (job.status === 'completed' || job.status === 'failed') {
+      return job.steps;
+    }
+    onStatus(job.status, job.partial_steps || []);
+  }
+  throw new Error('SOP generation is taking too long, please try again later');
+}
+
 export default function CreateSOPPage() {
   const { user } = useAuth();
   const router = useRouter();
@@ -145,6 +178,7 @@ Return ONLY a valid JSON array in this format:
       const formData = new FormData();
       formData.append('file', uploadedFile);
       formData.append('customPrompt', customPrompt);
+      formData.append('async', 'true');
       
       toast.loading('Analyzing document with AI...', { id: 'generating' });
       
@@ -166,7 +200,18 @@ Return ONLY a valid JSON array in this format:
         throw new Error(errorMessage);
       }
       
-      const { steps: generatedSteps } = await response.json();
+      const result = await response.json();
+      
+      // Long generations run as a background job that we poll
+      const generatedSteps = response.status === 202 && result.jobId
+        ? await waitForGenerationJob(result.jobId, (status, partialSteps) => {
+            const label = JOB_STAGE_LABELS[status] || 'Analyzing document with AI...';
+            toast.loading(
+              partialSteps.length ? `${label} (${partialSteps.length} steps so far)` : label,
+              { id: 'generating' }
+            );
+          })
+        : result.steps;
       
       // Create preview text
       const previewText = generatedSteps.map((step: any, index: number) => 
@@ -482,7 +527,7 @@ Return ONLY a valid JSON array in this format:
                     id="file-upload"
                     type="file"
                     className="hidden"
-                    accept=".pdf,.doc,.docx,.xls,.xlsx,.png,.jpg,.jpeg,.gif,.txt"
+                    accept=".pdf,.docx,.xlsx,.pptx,.odt,.png,.jpg,.jpeg,.gif,.webp,.txt,.md,.html,.htm"
                     onChange={(e) => {
                       const file = e.target.files?.[0];
                       if (file) {
@@ -562,7 +607,7 @@ Return ONLY a valid JSON array in this format:
               )}
               
               <p className="text-xs text-muted-foreground">
-                Supported formats: PDF, Word (.doc, .docx), Excel (.xls, .xlsx), Images (.png, .jpg), Text (.txt)
+                Supported formats: PDF, Word (.docx), Excel (.xlsx), PowerPoint (.pptx), OpenDocument (.odt), Images (.png, .jpg), Text (.txt, .md, .html)
               </p>
             </CardContent>
           </Card>
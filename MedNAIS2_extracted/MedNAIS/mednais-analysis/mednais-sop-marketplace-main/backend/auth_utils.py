@@ -3,9 +3,14 @@ JWT Authentication utilities for FastAPI backend
 """
 import os
 import jwt
+import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Optional
-from fastapi import HTTPException, Header
+from fastapi import HTTPException, Depends, Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from pathlib import Path
@@ -19,27 +24,130 @@ logger = logging.getLogger(__name__)
 JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_ALGORITHM = "HS256"
 
+# Verified-token cache (size 0 disables it)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+JWT_CACHE_MAX_TTL = float(os.getenv("JWT_CACHE_MAX_TTL", "300"))
+
 if not JWT_SECRET:
     logger.warning("JWT_SECRET not found in environment variables - JWT verification will fail")
 
 
 class UserContext(BaseModel):
-    """User context extracted from JWT token"""
+    """User context extracted from JWT token (API-facing model)"""
+    user_id: str
+    email: Optional[str] = None
+    name: Optional[str] = None
+    role: Optional[str] = "user"
+
+
+@dataclass(slots=True, frozen=True)
+class AuthUser:
+    """
+    Verified user used on the request hot path
+    
+    Built from an already signature-verified payload, so it skips pydantic
+    validation and has no per-instance __dict__. Instances are shared through
+    the token cache, so they are immutable. Convert with to_context() where a
+    pydantic model is needed (e.g. in a response body).
+    """
     user_id: str
     email: Optional[str] = None
     name: Optional[str] = None
     role: Optional[str] = "user"
+    
+    def to_context(self) -> UserContext:
+        """Convert to the pydantic UserContext model"""
+        return UserContext(
+            user_id=self.user_id,
+            email=self.email,
+            name=self.name,
+            role=self.role
+        )
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified tokens keyed by SHA-256 digest of the token
+    
+    Entries expire at the token's own "exp" claim (capped by max_ttl), so a
+    cached token is never accepted after it would have failed verification.
+    """
+    
+    def __init__(self, maxsize: int, max_ttl: float):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, tuple[float, AuthUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+    
+    def get(self, token: str) -> Optional[AuthUser]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, token: str, user: AuthUser, exp: Optional[float]):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.max_ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
 
 
-def verify_jwt_token(token: str) -> UserContext:
+_token_cache = VerifiedTokenCache(JWT_CACHE_SIZE, JWT_CACHE_MAX_TTL)
+
+
+def get_jwt_cache_stats() -> dict:
+    """Return hit/miss counters and size of the verified-token cache"""
+    return _token_cache.stats()
+
+
+def verify_jwt_token(token: str) -> AuthUser:
     """
     Verify JWT token and extract user context
     
+    Tokens that verified successfully are cached until they expire, so
+    repeated requests with the same token skip decoding and HMAC checks.
+    
     Args:
         token: JWT token string (without "Bearer " prefix)
         
     Returns:
-        UserContext: Extracted user information
+        AuthUser: Extracted user information
         
     Raises:
         HTTPException: If token is invalid or expired
@@ -50,6 +158,10 @@ def verify_jwt_token(token: str) -> UserContext:
             detail="JWT_SECRET not configured"
         )
     
+    cached = _token_cache.get(token)
+    if cached is not None:
+        return cached
+    
     try:
         # Decode and verify token
         payload = jwt.decode(
@@ -67,13 +179,17 @@ def verify_jwt_token(token: str) -> UserContext:
                 detail="Invalid token: missing user identifier"
             )
         
-        return UserContext(
+        user = AuthUser(
             user_id=user_id,
             email=payload.get("email"),
             name=payload.get("name"),
             role=payload.get("role", "user")
         )
+        _token_cache.put(token, user, payload.get("exp"))
+        return user
         
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=401, 
@@ -92,7 +208,7 @@ def verify_jwt_token(token: str) -> UserContext:
         )
 
 
-def get_user_from_auth_header(authorization: Optional[str] = None) -> UserContext:
+def get_user_from_auth_header(authorization: Optional[str] = None) -> AuthUser:
     """
     Extract and verify user from Authorization header
     
@@ -100,7 +216,7 @@ def get_user_from_auth_header(authorization: Optional[str] = None) -> UserContex
         authorization: Authorization header value (e.g., "Bearer <token>")
         
     Returns:
-        UserContext: Verified user information
+        AuthUser: Verified user information
         
     Raises:
         HTTPException: If authentication fails
@@ -124,7 +240,7 @@ def get_user_from_auth_header(authorization: Optional[str] = None) -> UserContex
     return verify_jwt_token(token)
 
 
-def get_optional_user_from_auth_header(authorization: Optional[str] = None) -> Optional[UserContext]:
+def get_optional_user_from_auth_header(authorization: Optional[str] = None) -> Optional[AuthUser]:
     """
     Extract user from Authorization header if present, otherwise return None
     Useful for endpoints that work both authenticated and unauthenticated
@@ -133,7 +249,7 @@ def get_optional_user_from_auth_header(authorization: Optional[str] = None) -> O
         authorization: Authorization header value (optional)
         
     Returns:
-        UserContext or None: User information if authenticated, None otherwise
+        AuthUser or None: User information if authenticated, None otherwise
     """
     if not authorization:
         return None
@@ -145,7 +261,7 @@ def get_optional_user_from_auth_header(authorization: Optional[str] = None) -> O
         return None
 
 
-def require_admin(user: UserContext):
+def require_admin(user: AuthUser):
     """
     Check if user has admin role
     
@@ -162,45 +278,79 @@ def require_admin(user: UserContext):
         )
 
 
+# Marks request.state.user as not yet resolved (None means anonymous)
+_UNRESOLVED = object()
+
+
+def resolve_request_user(request: Request) -> Optional[AuthUser]:
+    """
+    Resolve the user for this request once and store it on request.state
+    
+    The Authorization header is parsed and verified on first use only; every
+    later dependency in the same request reads request.state.user. When
+    authentication fails, the error is kept in request.state.auth_error.
+    
+    Args:
+        request: Current request
+        
+    Returns:
+        AuthUser or None: User information if authenticated, None otherwise
+    """
+    user = getattr(request.state, "user", _UNRESOLVED)
+    if user is not _UNRESOLVED:
+        return user
+    
+    try:
+        user = get_user_from_auth_header(request.headers.get("authorization"))
+        request.state.auth_error = None
+    except HTTPException as e:
+        user = None
+        request.state.auth_error = e
+    
+    request.state.user = user
+    return user
+
+
 # FastAPI dependency for requiring authentication
-async def get_current_user(authorization: Optional[str] = Header(None)) -> UserContext:
+async def get_current_user(request: Request) -> AuthUser:
     """
     FastAPI dependency to get current authenticated user
     
     Usage:
         @router.get("/protected")
-        async def protected_route(user: UserContext = Depends(get_current_user)):
+        async def protected_route(user: AuthUser = Depends(get_current_user)):
             return {"user_id": user.user_id}
     """
-    return get_user_from_auth_header(authorization)
+    user = resolve_request_user(request)
+    if user is None:
+        raise request.state.auth_error
+    return user
 
 
 # FastAPI dependency for optional authentication
-async def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[UserContext]:
+async def get_optional_user(request: Request) -> Optional[AuthUser]:
     """
     FastAPI dependency for optional authentication
     
     Usage:
         @router.get("/public")
-        async def public_route(user: Optional[UserContext] = Depends(get_optional_user)):
+        async def public_route(user: Optional[AuthUser] = Depends(get_optional_user)):
             if user:
                 return {"authenticated": True, "user_id": user.user_id}
             return {"authenticated": False}
     """
-    return get_optional_user_from_auth_header(authorization)
+    return resolve_request_user(request)
 
 
 # FastAPI dependency for requiring admin access
-async def require_admin_user(user: UserContext = Header(None)) -> UserContext:
+async def require_admin_user(user: AuthUser = Depends(get_current_user)) -> AuthUser:
     """
     FastAPI dependency to require admin authentication
     
     Usage:
         @router.post("/admin/action")
-        async def admin_action(user: UserContext = Depends(require_admin_user)):
+        async def admin_action(user: AuthUser = Depends(require_admin_user)):
             return {"message": "Admin action completed"}
     """
-    if not user:
-        raise HTTPException(status_code=401, detail="Authentication required")
     require_admin(user)
     return user
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: pydantic UserContext vs slotted AuthUser on the auth hot path
+
+Usage:
+    python backend/bench_user_context.py [iterations]
+"""
+import sys
+import timeit
+import tracemalloc
+
+from auth_utils import AuthUser, UserContext
+
+PAYLOAD = {
+    "user_id": "aa30358d-8ca0-47ff-8c26-813b45121050",
+    "email": "creator@example.com",
+    "name": "Test Creator",
+    "role": "user",
+}
+
+
+def build_context():
+    return UserContext(**PAYLOAD)
+
+
+def build_auth_user():
+    return AuthUser(**PAYLOAD)
+
+
+def bytes_per_instance(factory, count: int = 10_000) -> float:
+    """Average bytes still allocated per live instance"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    instances = [factory() for _ in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return (after - before) / count
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+    print(f"{'':12} {'ns/instance':>12} {'bytes/instance':>15}")
+    for label, factory in (("UserContext", build_context), ("AuthUser", build_auth_user)):
+        seconds = min(timeit.repeat(factory, number=iterations, repeat=5))
+        print(f"{label:12} {seconds / iterations * 1e9:12.0f} {bytes_per_instance(factory):15.0f}")
+
+
+if __name__ == "__main__":
+    main()
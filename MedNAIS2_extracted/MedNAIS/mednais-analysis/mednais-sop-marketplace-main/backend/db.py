@@ -0,0 +1,106 @@
+"""
+Application-scoped Prisma client shared by the FastAPI routes
+"""
+import os
+import asyncio
+import logging
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from fastapi import FastAPI, Request
+from prisma import Prisma
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings passed to the Prisma query engine (unset = engine default)
+PRISMA_CONNECTION_LIMIT = os.getenv("PRISMA_CONNECTION_LIMIT")
+PRISMA_POOL_TIMEOUT = os.getenv("PRISMA_POOL_TIMEOUT")
+
+_connect_lock = asyncio.Lock()
+
+
+def build_datasource_url(database_url: str) -> str:
+    """
+    Add pool settings to the database URL unless it already sets them
+    
+    Args:
+        database_url: PostgreSQL connection string
+        
+    Returns:
+        str: Connection string with connection_limit/pool_timeout parameters
+    """
+    parts = urlsplit(database_url)
+    params = dict(parse_qsl(parts.query, keep_blank_values=True))
+    
+    if PRISMA_CONNECTION_LIMIT:
+        params.setdefault("connection_limit", PRISMA_CONNECTION_LIMIT)
+    if PRISMA_POOL_TIMEOUT:
+        params.setdefault("pool_timeout", PRISMA_POOL_TIMEOUT)
+    
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+
+def create_prisma() -> Prisma:
+    """Create a Prisma client configured with the pool settings"""
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        return Prisma()
+    return Prisma(datasource={"url": build_datasource_url(database_url)})
+
+
+async def connect_prisma(app: FastAPI) -> Prisma:
+    """
+    Connect the application-wide Prisma client, creating it on first use
+    """
+    async with _connect_lock:
+        prisma = getattr(app.state, "prisma", None)
+        if prisma is None:
+            prisma = create_prisma()
+            app.state.prisma = prisma
+        if not prisma.is_connected():
+            await prisma.connect()
+            logger.info("Prisma client connected")
+        return prisma
+
+
+async def disconnect_prisma(app: FastAPI):
+    """Disconnect the application-wide Prisma client if it is connected"""
+    prisma = getattr(app.state, "prisma", None)
+    if prisma is not None and prisma.is_connected():
+        await prisma.disconnect()
+        logger.info("Prisma client disconnected")
+
+
+async def get_prisma(request: Request) -> Prisma:
+    """
+    FastAPI dependency returning the shared Prisma client
+    
+    Usage:
+        @router.get("/items")
+        async def list_items(prisma: Prisma = Depends(get_prisma)):
+            return await prisma.sop.find_many()
+    """
+    prisma = getattr(request.app.state, "prisma", None)
+    if prisma is not None and prisma.is_connected():
+        return prisma
+    return await connect_prisma(request.app)
+
+
+async def check_database(prisma: Optional[Prisma]) -> dict:
+    """
+    Run a trivial query to confirm the database is reachable
+    
+    Returns:
+        dict: {"status": "ok" | "error", "latency_ms": float, "error": str (on failure)}
+    """
+    if prisma is None or not prisma.is_connected():
+        return {"status": "error", "error": "Prisma client is not connected"}
+    
+    started = asyncio.get_running_loop().time()
+    try:
+        await prisma.query_raw("SELECT 1")
+    except Exception as e:
+        logger.error(f"Database health check failed: {e}")
+        return {"status": "error", "error": str(e)}
+    
+    latency = asyncio.get_running_loop().time() - started
+    return {"status": "ok", "latency_ms": round(latency * 1000, 2)}
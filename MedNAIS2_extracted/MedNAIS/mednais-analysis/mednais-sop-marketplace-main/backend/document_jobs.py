@@ -0,0 +1,230 @@
+"""
+Asynchronous SOP generation jobs run by a bounded worker pool
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle: queued -> extracting -> generating -> completed | failed
+FINISHED_STATUSES = {"completed", "failed"}
+
+# process(file_path, mime_type, custom_prompt, on_progress, use_cache, on_step, priority) -> steps
+ProcessFile = Callable[..., Awaitable[list]]
+# error_steps(error) -> placeholder steps describing the failure
+ErrorSteps = Callable[[object], list]
+
+# Queue order by job priority (same ranks as scripts/llm_scheduler.py)
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Rough share of the total work done when each stage starts
+STAGE_PROGRESS = {
+    "queued": 0.0,
+    "extracting": 0.1,
+    "generating": 0.3,
+    "completed": 1.0,
+    "failed": 1.0,
+}
+
+
+@dataclass
+class DocumentJob:
+    """A single file-to-SOP generation request"""
+    id: str
+    file_path: str
+    mime_type: str
+    custom_prompt: Optional[str] = None
+    delete_file: bool = False
+    use_cache: bool = True
+    priority: str = "normal"
+    status: str = "queued"
+    progress: float = 0.0
+    steps: Optional[list] = None
+    # Steps reported while generating, before chunk results are merged
+    partial_steps: list = field(default_factory=list)
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    version: int = 0
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def update(self, status: str, **changes):
+        """Apply a state change and wake anyone waiting on the job"""
+        self.status = status
+        self.progress = changes.pop("progress", STAGE_PROGRESS.get(status, self.progress))
+        for key, value in changes.items():
+            setattr(self, key, value)
+        if self.finished:
+            self.finished_at = time.time()
+        self._notify()
+
+    def _notify(self):
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def add_step(self, step: dict):
+        """Record a step generated so far and wake anyone waiting on the job"""
+        self.partial_steps.append(step)
+        self._notify()
+
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        """Wait until the job moves past `version`; False on timeout"""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 2),
+            "steps": self.steps,
+            "partial_steps": self.partial_steps,
+            "error": self.error,
+        }
+
+
+class DocumentJobManager:
+    """
+    Queue of generation jobs processed by a fixed number of workers
+
+    Submitting returns immediately; the HTTP request no longer waits for
+    extraction and the LLM call. Queued jobs start in priority order, then
+    in submission order. A job running longer than job_timeout seconds is
+    cancelled and fails (0 = no limit). Finished jobs are kept for
+    result_ttl seconds so clients can fetch the result.
+    """
+
+    def __init__(
+        self,
+        process: ProcessFile,
+        error_steps: ErrorSteps,
+        workers: int = 2,
+        max_queued: int = 100,
+        result_ttl: float = 900.0,
+        job_timeout: float = 600.0
+    ):
+        self.process = process
+        self.error_steps = error_steps
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.job_timeout = job_timeout
+        self._queue: "asyncio.PriorityQueue[tuple[int, int, DocumentJob]]" = asyncio.PriorityQueue(maxsize=max_queued)
+        self._submitted = itertools.count()
+        self._jobs: dict[str, DocumentJob] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"document-worker-{index}"))
+        logger.info(f"Started {self.workers} document workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def submit(
+        self,
+        file_path: str,
+        mime_type: str,
+        custom_prompt: Optional[str] = None,
+        delete_file: bool = False,
+        use_cache: bool = True,
+        priority: str = "normal"
+    ) -> DocumentJob:
+        """
+        Queue a job
+
+        Raises:
+            asyncio.QueueFull: If max_queued jobs are already waiting
+        """
+        self._prune()
+        job = DocumentJob(
+            id=uuid.uuid4().hex,
+            file_path=file_path,
+            mime_type=mime_type,
+            custom_prompt=custom_prompt,
+            delete_file=delete_file,
+            use_cache=use_cache,
+            priority=priority
+        )
+        rank = JOB_PRIORITIES.get(priority, JOB_PRIORITIES["normal"])
+        self._queue.put_nowait((rank, next(self._submitted), job))
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[DocumentJob]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize(),
+            "tracked": len(self._jobs),
+        }
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: DocumentJob):
+        try:
+            steps = await asyncio.wait_for(
+                self.process(
+                    job.file_path,
+                    job.mime_type,
+                    job.custom_prompt,
+                    on_progress=job.update,
+                    use_cache=job.use_cache,
+                    on_step=job.add_step,
+                    priority=job.priority
+                ),
+                self.job_timeout or None
+            )
+            job.update("completed", steps=steps)
+        except asyncio.TimeoutError:
+            error = f"Job timed out after {self.job_timeout:g}s"
+            logger.error(f"Document job {job.id} failed: {error}")
+            job.update("failed", error=error, steps=self.error_steps(error))
+        except asyncio.CancelledError:
+            job.update("failed", error="Job cancelled", steps=self.error_steps("Job cancelled"))
+            raise
+        except Exception as e:
+            logger.error(f"Document job {job.id} failed: {e}")
+            job.update("failed", error=str(e), steps=self.error_steps(e))
+        finally:
+            if job.delete_file:
+                try:
+                    os.unlink(job.file_path)
+                except OSError:
+                    pass
@@ -0,0 +1,194 @@
+"""
+Document-to-SOP generation served by the long-running backend process
+
+The Next.js upload route used to spawn scripts/process_document.py for every
+file, paying interpreter startup and parser/LLM client imports each time.
+Importing it here keeps those libraries loaded for the life of the worker.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+from pathlib import Path
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from document_jobs import DocumentJob, DocumentJobManager
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+import process_document  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/documents", tags=["documents"])
+
+# Directory the Next.js route writes uploads to; only files in it are processed
+DOCUMENT_UPLOAD_DIR = Path(os.getenv("DOCUMENT_UPLOAD_DIR", "/tmp")).resolve()
+
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+# Background generation jobs
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", "2"))
+DOCUMENT_MAX_QUEUED_JOBS = int(os.getenv("DOCUMENT_MAX_QUEUED_JOBS", "100"))
+DOCUMENT_JOB_RESULT_TTL = float(os.getenv("DOCUMENT_JOB_RESULT_TTL", "900"))
+DOCUMENT_JOB_TIMEOUT = float(os.getenv("DOCUMENT_JOB_TIMEOUT", "600"))
+
+# Seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_KEEPALIVE = 15.0
+
+
+class GenerateStepsRequest(BaseModel):
+    file_path: str
+    mime_type: str = "application/octet-stream"
+    custom_prompt: Optional[str] = None
+    # False forces a fresh LLM call instead of a cached response
+    use_cache: bool = True
+    # "high" for paying creators; orders jobs and LLM calls
+    priority: Literal["high", "normal", "low"] = "normal"
+
+
+class SubmitJobRequest(GenerateStepsRequest):
+    # Let the job delete the uploaded file when it finishes
+    delete_file: bool = True
+
+
+def create_document_job_manager() -> DocumentJobManager:
+    """Build the worker pool that runs background generation jobs"""
+    return DocumentJobManager(
+        process_document.process_file,
+        process_document.error_steps,
+        workers=DOCUMENT_WORKERS,
+        max_queued=DOCUMENT_MAX_QUEUED_JOBS,
+        result_ttl=DOCUMENT_JOB_RESULT_TTL,
+        job_timeout=DOCUMENT_JOB_TIMEOUT
+    )
+
+
+def get_llm_scheduler_stats() -> dict:
+    """Usage of the scheduler shared by all LLM calls in this process"""
+    return process_document.llm_scheduler.stats()
+
+
+def get_job(request: Request, job_id: str) -> DocumentJob:
+    job = request.app.state.document_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+async def require_local_caller(request: Request):
+    """
+    Only accept jobs from processes on this host (the Next.js server)
+    The backend is publicly reachable through the proxy, and jobs reference
+    files on local disk
+    """
+    client_host = request.client.host if request.client else None
+    if client_host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Document processing is only available locally")
+
+
+def resolve_upload_path(file_path: str) -> Path:
+    """Resolve an uploaded file path, rejecting anything outside the upload directory"""
+    path = Path(file_path).resolve()
+    if path.parent != DOCUMENT_UPLOAD_DIR or not path.name.startswith("upload-"):
+        raise HTTPException(status_code=400, detail="File is not in the upload directory")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Uploaded file not found")
+    return path
+
+
+@router.post("/generate", dependencies=[Depends(require_local_caller)])
+async def generate_steps(request_data: GenerateStepsRequest):
+    """
+    Generate SOP steps from an uploaded file
+    Mirrors the CLI: processing errors are returned as a single error step
+    """
+    path = resolve_upload_path(request_data.file_path)
+    
+    try:
+        steps = await process_document.process_file(
+            str(path),
+            request_data.mime_type,
+            request_data.custom_prompt,
+            use_cache=request_data.use_cache,
+            priority=request_data.priority
+        )
+    except Exception as e:
+        logger.error(f"Error generating steps from {path.name}: {e}")
+        steps = process_document.error_steps(e)
+    
+    return {"success": True, "steps": steps}
+
+
+@router.post("/jobs", dependencies=[Depends(require_local_caller)])
+async def submit_job(request_data: SubmitJobRequest, request: Request):
+    """
+    Queue SOP generation for an uploaded file and return the job id immediately
+    """
+    path = resolve_upload_path(request_data.file_path)
+    
+    try:
+        job = request.app.state.document_jobs.submit(
+            str(path),
+            request_data.mime_type,
+            request_data.custom_prompt,
+            delete_file=request_data.delete_file,
+            use_cache=request_data.use_cache,
+            priority=request_data.priority
+        )
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Too many documents are being processed, try again shortly")
+    
+    logger.info(f"Queued document job {job.id} for {path.name}")
+    return JSONResponse(content=job.to_dict(), status_code=202)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, request: Request):
+    """
+    Get the status of a generation job; steps are included once it finishes
+    Job ids are random 128-bit values, so they are not restricted to local callers
+    """
+    return get_job(request, job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    Server-sent events: "step" for each step as it is generated and "status"
+    whenever the job moves to another stage
+    The stream ends with the final status once the job has completed or failed
+    """
+    job = get_job(request, job_id)
+    
+    async def events():
+        version = -1
+        status = None
+        sent_steps = 0
+        while True:
+            if job.version != version:
+                version = job.version
+                for step in job.partial_steps[sent_steps:]:
+                    yield f"event: step\ndata: {json.dumps(step)}\n\n"
+                sent_steps = len(job.partial_steps)
+                if job.status != status or job.finished:
+                    status = job.status
+                    yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            if await request.is_disconnected():
+                return
+            if not await job.wait_for_change(version, EVENT_STREAM_KEEPALIVE):
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,145 @@
+"""
+Checkout fulfillment: completes payment transactions and records purchases
+"""
+import json
+import logging
+from typing import Optional
+from prisma import Prisma
+from prisma.models import PaymentTransaction
+
+logger = logging.getLogger(__name__)
+
+# Revenue split applied to every purchase (30% platform, 70% creator)
+PLATFORM_FEE_RATE = 0.30
+
+# Stripe checkout session status -> PaymentTransaction status
+STATUS_MAP = {
+    "complete": "COMPLETED",
+    "expired": "EXPIRED",
+    "open": "PENDING"
+}
+
+
+def load_metadata(payment_tx: PaymentTransaction) -> dict:
+    """Return the transaction metadata as a dict (it is stored as a JSON string)"""
+    metadata = payment_tx.metadata
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def split_revenue(price: float) -> tuple[float, float]:
+    """Split a price into (platform fee, creator revenue)"""
+    platform_fee = price * PLATFORM_FEE_RATE
+    return platform_fee, price - platform_fee
+
+
+async def build_purchase_rows(prisma: Prisma, payment_tx: PaymentTransaction) -> list[dict]:
+    """
+    Build the Purchase rows for a paid transaction (one per SOP)
+
+    Cart checkouts list their SOP ids in "cart_items"; per-item prices and
+    creators come from the stored "items" metadata, or from the SOPs
+    themselves for transactions created before it was recorded.
+    """
+    metadata = load_metadata(payment_tx)
+    session_id = payment_tx.sessionId
+    buyer_id = payment_tx.userId
+
+    if metadata.get("cart_items"):
+        items = metadata.get("items")
+        if not items:
+            sop_ids = [sop_id for sop_id in metadata["cart_items"].split(",") if sop_id]
+            sops = await prisma.sop.find_many(where={"id": {"in": sop_ids}})
+            items = [
+                {"sop_id": sop.id, "creator_id": sop.creatorId, "price": sop.price or 0}
+                for sop in sops
+            ]
+        # Cart item prices are in cents
+        lines = [
+            (item["sop_id"], item["creator_id"], float(item["price"]) / 100.0)
+            for item in items
+        ]
+    elif metadata.get("sop_id") and metadata.get("creator_id"):
+        lines = [(metadata["sop_id"], metadata["creator_id"], payment_tx.amount)]
+    else:
+        return []
+
+    rows = []
+    for sop_id, creator_id, price in lines:
+        platform_fee, creator_revenue = split_revenue(price)
+        rows.append({
+            "sopId": sop_id,
+            "buyerId": buyer_id,
+            "sellerId": creator_id,
+            "price": price,
+            "platformFee": platform_fee,
+            "creatorRevenue": creator_revenue,
+            "stripePaymentId": session_id
+        })
+    return rows
+
+
+async def fulfill_checkout(
+    prisma: Prisma,
+    session_id: str,
+    payment_status: Optional[str],
+    payment_id: Optional[str] = None
+):
+    """
+    Mark a checkout session as completed and create its Purchase records
+
+    The status update and all purchases of the session (one for a single
+    SOP, one per item for a cart) are written in a single transaction with
+    one batched insert. Safe to call more than once for the same session,
+    also concurrently: the unique (stripePaymentId, sopId) constraint makes
+    the insert skip purchases that already exist.
+
+    Raises:
+        LookupError: If no payment transaction exists for the session
+    """
+    payment_tx = await prisma.paymenttransaction.find_unique(
+        where={"sessionId": session_id}
+    )
+
+    if not payment_tx:
+        raise LookupError(f"Payment transaction not found for session {session_id}")
+
+    rows = []
+    # Async payment methods complete the session before the money arrives
+    if payment_status == "paid":
+        if payment_tx.userId:
+            rows = await build_purchase_rows(prisma, payment_tx)
+        else:
+            # Guest purchases are not recorded in Purchase table
+            logger.info(f"Guest purchase completed for session {session_id} - no Purchase record created")
+
+    async with prisma.tx() as tx:
+        if payment_tx.status != "COMPLETED" or payment_tx.paymentStatus != payment_status:
+            data = {"status": "COMPLETED", "paymentStatus": payment_status}
+            if payment_id:
+                data["paymentId"] = payment_id
+            await tx.paymenttransaction.update(where={"sessionId": session_id}, data=data)
+
+        if not rows:
+            return
+
+        # Purchases already recorded for this session are skipped by the database
+        created = await tx.purchase.create_many(data=rows, skip_duplicates=True)
+
+    if created:
+        logger.info(
+            f"Created {created} purchase record(s) for session {session_id} "
+            f"by user {payment_tx.userId}"
+        )
+
+
+async def expire_checkout(prisma: Prisma, session_id: str):
+    """Mark a pending checkout session as expired"""
+    await prisma.paymenttransaction.update_many(
+        where={"sessionId": session_id, "status": "PENDING"},
+        data={"status": "EXPIRED"}
+    )
@@ -4,9 +4,14 @@ FastAPI backend with Stripe integration
 Proxies other requests to Next.js on port 3000
 """
 
+import os
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import httpx
 import logging
 from dotenv import load_dotenv
@@ -14,10 +19,143 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+from db import connect_prisma, disconnect_prisma, check_database
+from auth_utils import get_jwt_cache_stats
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Next.js server URL
+NEXTJS_URL = os.getenv("NEXTJS_URL", "http://localhost:3000")
+
+# Proxy connection pool settings
+PROXY_MAX_CONNECTIONS = int(os.getenv("PROXY_MAX_CONNECTIONS", "100"))
+PROXY_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROXY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+PROXY_KEEPALIVE_EXPIRY = float(os.getenv("PROXY_KEEPALIVE_EXPIRY", "30"))
+PROXY_CONNECT_TIMEOUT = float(os.getenv("PROXY_CONNECT_TIMEOUT", "5"))
+PROXY_POOL_TIMEOUT = float(os.getenv("PROXY_POOL_TIMEOUT", "10"))
+PROXY_DEFAULT_TIMEOUT = float(os.getenv("PROXY_DEFAULT_TIMEOUT", "30"))
+
+# Stream request and response bodies instead of buffering them in memory
+PROXY_STREAMING = os.getenv("PROXY_STREAMING", "true").lower() == "true"
+
+# Per-route read timeouts, matched by path prefix (AI endpoints need longer timeout)
+PROXY_ROUTE_TIMEOUTS = {
+    "api/sops/generate-from-file": float(os.getenv("PROXY_AI_TIMEOUT", "120")),
+}
+
+
+# Hop-by-hop headers apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+# Methods that never carry a request body
+BODYLESS_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ProxyMetrics:
+    """Counters for proxied requests, exposed at /api/proxy/metrics"""
+
+    def __init__(self):
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, elapsed: float, error: bool = False):
+        self.requests_total += 1
+        if error:
+            self.errors_total += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+
+    def snapshot(self) -> dict:
+        avg = self.latency_total / self.requests_total if self.requests_total else 0.0
+        return {
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "in_flight": self.in_flight,
+            "latency_avg_ms": round(avg * 1000, 2),
+            "latency_max_ms": round(self.latency_max * 1000, 2),
+        }
+
+
+def create_proxy_client() -> httpx.AsyncClient:
+    """Build the process-wide client used to forward requests to Next.js"""
+    return httpx.AsyncClient(
+        base_url=NEXTJS_URL,
+        follow_redirects=True,
+        timeout=httpx.Timeout(
+            PROXY_DEFAULT_TIMEOUT,
+            connect=PROXY_CONNECT_TIMEOUT,
+            pool=PROXY_POOL_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=PROXY_MAX_CONNECTIONS,
+            max_keepalive_connections=PROXY_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=PROXY_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_route_timeout(path: str) -> httpx.Timeout:
+    """Resolve the timeout for a proxied path"""
+    read_timeout = PROXY_DEFAULT_TIMEOUT
+    for prefix, route_timeout in PROXY_ROUTE_TIMEOUTS.items():
+        if path.startswith(prefix):
+            read_timeout = route_timeout
+            break
+    return httpx.Timeout(read_timeout, connect=PROXY_CONNECT_TIMEOUT, pool=PROXY_POOL_TIMEOUT)
+
+
+def get_pool_stats(client: httpx.AsyncClient) -> dict:
+    """
+    Describe the connections held by the client's pool
+    httpx does not expose pool state publicly, so read it defensively from httpcore
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "max_connections": PROXY_MAX_CONNECTIONS,
+        "max_keepalive_connections": PROXY_MAX_KEEPALIVE_CONNECTIONS,
+    }
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients on startup and release them on shutdown"""
+    app.state.proxy_client = create_proxy_client()
+    app.state.proxy_metrics = ProxyMetrics()
+    prisma = await connect_prisma(app)
+    app.state.webhook_workers = create_webhook_worker_pool(prisma)
+    await app.state.webhook_workers.start()
+    app.state.document_jobs = create_document_job_manager()
+    await app.state.document_jobs.start()
+    try:
+        yield
+    finally:
+        await app.state.document_jobs.stop()
+        await app.state.webhook_workers.stop()
+        await disconnect_prisma(app)
+        await app.state.proxy_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -29,18 +167,78 @@ app.add_middleware(
 )
 
 # Import and include Stripe routes
-from stripe_routes import router as stripe_router
+from stripe_routes import router as stripe_router, create_webhook_worker_pool
 app.include_router(stripe_router)
 
-# Next.js server URL
-NEXTJS_URL = "http://localhost:3000"
+# Import and include document processing routes
+from document_routes import router as document_router, create_document_job_manager, get_llm_scheduler_stats
+app.include_router(document_router)
+
+
+@app.get("/api/backend/health")
+async def backend_health(request: Request):
+    """
+    Report database connectivity, worker queues, auth cache and LLM scheduler state of the FastAPI backend
+    """
+    database = await check_database(getattr(request.app.state, "prisma", None))
+    status_code = 200 if database["status"] == "ok" else 503
+    return JSONResponse(
+        content={
+            "status": database["status"],
+            "database": database,
+            "webhook_workers": request.app.state.webhook_workers.stats(),
+            "document_jobs": request.app.state.document_jobs.stats(),
+            "jwt_cache": get_jwt_cache_stats(),
+            "llm_scheduler": get_llm_scheduler_stats()
+        },
+        status_code=status_code
+    )
+
+
+@app.get("/api/proxy/metrics")
+async def proxy_metrics(request: Request):
+    """
+    Report proxy request counters and connection pool usage
+    """
+    return {
+        "requests": request.app.state.proxy_metrics.snapshot(),
+        "pool": get_pool_stats(request.app.state.proxy_client),
+    }
+
+
+def filter_headers(headers: httpx.Headers, exclude: set = frozenset()) -> list:
+    """Drop hop-by-hop headers, keeping repeated headers such as Set-Cookie"""
+    return [
+        (key, value)
+        for key, value in headers.multi_items()
+        if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() not in exclude
+    ]
+
+
+async def relay_body(upstream: httpx.Response, finish):
+    """
+    Yield the upstream body chunk by chunk as the client consumes it
+    Raw bytes are relayed so Content-Encoding and Content-Length stay valid;
+    finish(error) is called once the body is done
+    """
+    error = False
+    try:
+        async for chunk in upstream.aiter_raw():
+            yield chunk
+    except Exception:
+        error = True
+        raise
+    finally:
+        await upstream.aclose()
+        finish(error)
+
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"])
 async def proxy(path: str, request: Request):
     """
     Proxy all requests to Next.js server
     """
-    url = f"{NEXTJS_URL}/{path}"
+    url = f"/{path}"
     
     # Get query parameters
     query_string = str(request.url.query)
@@ -50,38 +248,84 @@ async def proxy(path: str, request: Request):
     logger.info(f"Proxying {request.method} {url}")
     
     # Prepare headers
-    headers = dict(request.headers)
     # Remove host header as httpx will set it automatically
-    headers.pop('host', None)
+    headers = filter_headers(httpx.Headers(request.headers.raw), exclude={"host"})
     
-    # Get request body
-    body = await request.body()
-    
-    # Set timeout based on endpoint (AI endpoints need longer timeout)
-    timeout = 120.0 if 'generate-from-file' in url or 'ai' in url.lower() else 30.0
+    client: httpx.AsyncClient = request.app.state.proxy_client
+    metrics: ProxyMetrics = request.app.state.proxy_metrics
     
     # Forward request to Next.js
-    async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as client:
-        try:
-            response = await client.request(
+    metrics.in_flight += 1
+    started = time.perf_counter()
+    finished = False
+    streaming = False
+    
+    def finish(error: bool = False):
+        # Streamed responses finish in relay_body, after this handler has returned
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        metrics.in_flight -= 1
+        metrics.record(time.perf_counter() - started, error=error)
+    
+    try:
+        if PROXY_STREAMING:
+            # Pipe the request body through without reading it into memory
+            content = None if request.method in BODYLESS_METHODS else request.stream()
+            upstream_request = client.build_request(
                 method=request.method,
                 url=url,
                 headers=headers,
-                content=body
+                content=content,
+                timeout=get_route_timeout(path)
             )
+            # A consumed request stream can't be replayed to a redirect target,
+            # so redirects are passed back to the client
+            upstream = await client.send(upstream_request, stream=True, follow_redirects=False)
             
-            # Return response
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=dict(response.headers)
-            )
-        except Exception as e:
-            logger.error(f"Error proxying request: {e}")
-            return Response(
-                content=f"Proxy error: {str(e)}",
-                status_code=502
+            async def close_upstream():
+                await upstream.aclose()
+                finish()
+            
+            response = StreamingResponse(
+                relay_body(upstream, finish),
+                status_code=upstream.status_code,
+                background=BackgroundTask(close_upstream)
             )
+            for key, value in filter_headers(upstream.headers):
+                response.headers.append(key, value)
+            streaming = True
+            return response
+        
+        response = await client.request(
+            method=request.method,
+            url=url,
+            headers=headers,
+            content=await request.body(),
+            timeout=get_route_timeout(path)
+        )
+        finish()
+        
+        # Return response
+        # The body has already been decoded, so encoding and length no longer apply
+        buffered = Response(content=response.content, status_code=response.status_code)
+        for key, value in filter_headers(
+            response.headers, exclude={"content-encoding", "content-length"}
+        ):
+            buffered.headers.append(key, value)
+        return buffered
+    except Exception as e:
+        finish(error=True)
+        logger.error(f"Error proxying request: {e}")
+        return Response(
+            content=f"Proxy error: {str(e)}",
+            status_code=502
+        )
+    finally:
+        # Cancelled before a response was produced
+        if not streaming:
+            finish(error=True)
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,12 +2,18 @@
 Stripe payment integration using emergentintegrations
 """
 import os
+import time
 import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Request, Header, Depends
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from pathlib import Path
+from prisma import Prisma
+from prisma.errors import UniqueViolationError
+from prisma.models import StripeWebhookEvent
 
 from emergentintegrations.payments.stripe.checkout import (
     StripeCheckout,
@@ -16,7 +22,10 @@ from emergentintegrations.payments.stripe.checkout import (
     CheckoutSessionRequest
 )
 
-from .auth_utils import get_current_user, get_optional_user_from_auth_header, UserContext
+from auth_utils import get_current_user, get_optional_user, AuthUser
+from db import get_prisma
+from webhook_queue import WebhookWorkerPool
+from fulfillment import STATUS_MAP, load_metadata, fulfill_checkout, expire_checkout
 
 # Load environment variables from parent directory
 env_path = Path(__file__).parent.parent / '.env'
@@ -31,6 +40,56 @@ STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
 if not STRIPE_API_KEY:
     raise RuntimeError("STRIPE_API_KEY not found in environment variables")
 
+# Public base URL used to build the webhook URL (falls back to the request base URL)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")
+
+# Maximum number of StripeCheckout clients kept warm, one per webhook URL
+STRIPE_CLIENT_CACHE_SIZE = int(os.getenv("STRIPE_CLIENT_CACHE_SIZE", "8"))
+
+# Background webhook processing
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_RETRY_BASE_DELAY = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", "2"))
+WEBHOOK_SWEEP_INTERVAL = float(os.getenv("WEBHOOK_SWEEP_INTERVAL", "60"))
+
+# Checkout status is served from the database; cache it briefly between polls
+CHECKOUT_STATUS_CACHE_TTL = float(os.getenv("CHECKOUT_STATUS_CACHE_TTL", "2"))
+CHECKOUT_STATUS_FINAL_CACHE_TTL = float(os.getenv("CHECKOUT_STATUS_FINAL_CACHE_TTL", "300"))
+CHECKOUT_STATUS_CACHE_SIZE = 1024
+
+# Ask Stripe directly only if the webhook has not arrived after this many seconds
+CHECKOUT_STATUS_STRIPE_FALLBACK_SECONDS = float(os.getenv("CHECKOUT_STATUS_STRIPE_FALLBACK_SECONDS", "30"))
+
+_stripe_clients: "OrderedDict[str, StripeCheckout]" = OrderedDict()
+_checkout_status_cache: "OrderedDict[str, tuple[float, CheckoutStatusResponse]]" = OrderedDict()
+
+
+def get_webhook_url(req: Request) -> str:
+    """Resolve the public webhook URL for this deployment"""
+    host_url = PUBLIC_BASE_URL or str(req.base_url)
+    return f"{host_url.rstrip('/')}/api/stripe/webhook"
+
+
+def get_stripe_checkout(req: Request) -> StripeCheckout:
+    """
+    Return a cached StripeCheckout client for the request's webhook URL
+    
+    Clients are kept in a small LRU so hot checkout paths reuse an
+    initialized SDK and its connection pool to Stripe.
+    """
+    webhook_url = get_webhook_url(req)
+    
+    stripe_checkout = _stripe_clients.get(webhook_url)
+    if stripe_checkout is not None:
+        _stripe_clients.move_to_end(webhook_url)
+        return stripe_checkout
+    
+    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+    _stripe_clients[webhook_url] = stripe_checkout
+    while len(_stripe_clients) > STRIPE_CLIENT_CACHE_SIZE:
+        _stripe_clients.popitem(last=False)
+    return stripe_checkout
+
 
 class CreateCheckoutRequest(BaseModel):
     sop_id: str
@@ -58,98 +117,85 @@ class CheckoutStatusRequest(BaseModel):
 async def create_checkout_session(
     request_data: CreateCheckoutRequest, 
     req: Request,
-    authorization: Optional[str] = Header(None)
+    user_context: Optional[AuthUser] = Depends(get_optional_user),
+    prisma: Prisma = Depends(get_prisma)
 ):
     """
     Create a Stripe checkout session for purchasing a SOP
     Supports both authenticated and guest checkout
     """
     try:
-        from prisma import Prisma
-        from prisma.models import User, SOP
+        # Current user is optional - supports guest checkout
+        buyer_id = user_context.user_id if user_context else None
+        user_email = user_context.email if user_context else None
         
-        # Initialize Prisma client
-        prisma = Prisma()
-        await prisma.connect()
+        # Get SOP details
+        sop = await prisma.sop.find_unique(
+            where={"id": request_data.sop_id},
+            include={"creator": True}
+        )
+        
+        if not sop:
+            raise HTTPException(status_code=404, detail="SOP not found")
+        
+        if sop.type != "MARKETPLACE":
+            raise HTTPException(status_code=400, detail="SOP is not available for purchase")
+        
+        if not sop.price:
+            raise HTTPException(status_code=400, detail="SOP has no price set")
+        
+        # Convert price from cents to dollars (e.g., 1000 cents = 10.00 dollars)
+        # Playbook requires amount in float format dollars
+        amount = float(sop.price) / 100.0
+        
+        # Build success and cancel URLs
+        success_url = f"{request_data.origin_url}/purchase-success?session_id={{CHECKOUT_SESSION_ID}}"
+        cancel_url = f"{request_data.origin_url}/marketplace"
+        
+        # Metadata to track this purchase
+        metadata = {
+            "sop_id": sop.id,
+            "sop_title": sop.title,
+            "creator_id": sop.creatorId,
+            "source": "web_checkout"
+        }
+        
+        # Get Stripe checkout client
+        stripe_checkout = get_stripe_checkout(req)
+        
+        # Create checkout session request
+        checkout_request = CheckoutSessionRequest(
+            amount=amount,
+            currency="usd",
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata
+        )
+        
+        # Create checkout session
+        session = await stripe_checkout.create_checkout_session(checkout_request)
+        
+        # Store payment transaction in database
+        import json
+        payment_data = {
+            "sessionId": session.session_id,
+            "amount": amount,
+            "currency": "usd",
+            "status": "PENDING",
+            "metadata": json.dumps(metadata),  # Convert dict to JSON string
+            "userEmail": user_email
+        }
+        
+        # Add userId if user is authenticated
+        if buyer_id:
+            payment_data["userId"] = buyer_id
+        
+        await prisma.paymenttransaction.create(data=payment_data)
+        
+        logger.info(f"Created checkout session {session.session_id} for SOP {sop.id}")
+        
+        return session
         
-        try:
-            # Get current user from JWT token (optional - supports guest checkout)
-            user_context = get_optional_user_from_auth_header(authorization)
-            buyer_id = user_context.user_id if user_context else None
-            user_email = user_context.email if user_context else None
-            
-            # Get SOP details
-            sop = await prisma.sop.find_unique(
-                where={"id": request_data.sop_id},
-                include={"creator": True}
-            )
-            
-            if not sop:
-                raise HTTPException(status_code=404, detail="SOP not found")
-            
-            if sop.type != "MARKETPLACE":
-                raise HTTPException(status_code=400, detail="SOP is not available for purchase")
-            
-            if not sop.price:
-                raise HTTPException(status_code=400, detail="SOP has no price set")
-            
-            # Convert price from cents to dollars (e.g., 1000 cents = 10.00 dollars)
-            # Playbook requires amount in float format dollars
-            amount = float(sop.price) / 100.0
-            
-            # Build success and cancel URLs
-            success_url = f"{request_data.origin_url}/purchase-success?session_id={{CHECKOUT_SESSION_ID}}"
-            cancel_url = f"{request_data.origin_url}/marketplace"
-            
-            # Metadata to track this purchase
-            metadata = {
-                "sop_id": sop.id,
-                "sop_title": sop.title,
-                "creator_id": sop.creatorId,
-                "source": "web_checkout"
-            }
-            
-            # Initialize Stripe checkout
-            host_url = str(req.base_url)
-            webhook_url = f"{host_url}api/stripe/webhook"
-            stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-            
-            # Create checkout session request
-            checkout_request = CheckoutSessionRequest(
-                amount=amount,
-                currency="usd",
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata=metadata
-            )
-            
-            # Create checkout session
-            session = await stripe_checkout.create_checkout_session(checkout_request)
-            
-            # Store payment transaction in database
-            import json
-            payment_data = {
-                "sessionId": session.session_id,
-                "amount": amount,
-                "currency": "usd",
-                "status": "PENDING",
-                "metadata": json.dumps(metadata),  # Convert dict to JSON string
-                "userEmail": user_email
-            }
-            
-            # Add userId if user is authenticated
-            if buyer_id:
-                payment_data["userId"] = buyer_id
-            
-            await prisma.paymenttransaction.create(data=payment_data)
-            
-            logger.info(f"Created checkout session {session.session_id} for SOP {sop.id}")
-            
-            return session
-            
-        finally:
-            await prisma.disconnect()
-            
     except HTTPException:
         raise
     except Exception as e:
@@ -157,113 +203,107 @@ async def create_checkout_session(
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
 
+def get_cached_checkout_status(session_id: str) -> Optional[CheckoutStatusResponse]:
+    entry = _checkout_status_cache.get(session_id)
+    if entry is None:
+        return None
+    expires_at, checkout_status = entry
+    if expires_at < time.monotonic():
+        _checkout_status_cache.pop(session_id, None)
+        return None
+    return checkout_status
+
+
+def cache_checkout_status(session_id: str, checkout_status: CheckoutStatusResponse):
+    ttl = CHECKOUT_STATUS_CACHE_TTL if checkout_status.status == "open" else CHECKOUT_STATUS_FINAL_CACHE_TTL
+    _checkout_status_cache[session_id] = (time.monotonic() + ttl, checkout_status)
+    _checkout_status_cache.move_to_end(session_id)
+    while len(_checkout_status_cache) > CHECKOUT_STATUS_CACHE_SIZE:
+        _checkout_status_cache.popitem(last=False)
+
+
+def invalidate_checkout_status(session_id: str):
+    _checkout_status_cache.pop(session_id, None)
+
+
+def build_checkout_status(payment_tx) -> CheckoutStatusResponse:
+    """Describe a payment transaction in the shape returned by Stripe"""
+    stripe_status = {value: key for key, value in STATUS_MAP.items()}.get(payment_tx.status, "open")
+    return CheckoutStatusResponse(
+        status=stripe_status,
+        payment_status=payment_tx.paymentStatus or "unpaid",
+        amount_total=int(round(payment_tx.amount * 100)),  # Convert to cents
+        currency=payment_tx.currency,
+        # Only the flat string metadata that was also sent to Stripe
+        metadata={
+            key: value
+            for key, value in load_metadata(payment_tx).items()
+            if isinstance(value, str)
+        }
+    )
+
+
+async def reconcile_with_stripe(req: Request, prisma: Prisma, session_id: str):
+    """
+    Fetch the session from Stripe and apply it as the webhook would
+    Used when a webhook is late or was never delivered
+    """
+    stripe_checkout = get_stripe_checkout(req)
+    checkout_status = await stripe_checkout.get_checkout_status(session_id)
+    
+    new_status = STATUS_MAP.get(checkout_status.status, "PENDING")
+    if new_status == "COMPLETED":
+        await fulfill_checkout(
+            prisma,
+            session_id,
+            checkout_status.payment_status,
+            checkout_status.metadata.get("payment_intent_id") if checkout_status.metadata else None
+        )
+    elif new_status == "EXPIRED":
+        await expire_checkout(prisma, session_id)
+
+
 @router.get("/checkout-status/{session_id}", response_model=CheckoutStatusResponse)
 async def get_checkout_status(
     session_id: str, 
     req: Request,
-    authorization: Optional[str] = Header(None)
+    prisma: Prisma = Depends(get_prisma)
 ):
     """
-    Get the status of a Stripe checkout session and update database
-    Supports both authenticated and guest checkout
+    Get the status of a Stripe checkout session from the database
+    Purchases are recorded by the webhook; Stripe is only queried when the
+    webhook is overdue
     """
     try:
-        from prisma import Prisma
+        cached = get_cached_checkout_status(session_id)
+        if cached is not None:
+            return cached
         
-        prisma = Prisma()
-        await prisma.connect()
+        # Find payment transaction
+        payment_tx = await prisma.paymenttransaction.find_unique(
+            where={"sessionId": session_id}
+        )
         
-        try:
-            # Initialize Stripe checkout
-            host_url = str(req.base_url)
-            webhook_url = f"{host_url}api/stripe/webhook"
-            stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-            
-            # Get checkout status from Stripe
-            checkout_status = await stripe_checkout.get_checkout_status(session_id)
-            
-            # Find payment transaction
-            payment_tx = await prisma.paymenttransaction.find_unique(
-                where={"sessionId": session_id}
-            )
-            
-            if not payment_tx:
-                raise HTTPException(status_code=404, detail="Payment transaction not found")
-            
-            # Update payment transaction status
-            status_map = {
-                "complete": "COMPLETED",
-                "expired": "EXPIRED",
-                "open": "PENDING"
-            }
-            
-            new_status = status_map.get(checkout_status.status, "PENDING")
-            
-            # Only update if status changed
-            if payment_tx.status != new_status:
-                await prisma.paymenttransaction.update(
-                    where={"sessionId": session_id},
-                    data={
-                        "status": new_status,
-                        "paymentStatus": checkout_status.payment_status,
-                        "paymentId": checkout_status.metadata.get("payment_intent_id") if checkout_status.metadata else None
-                    }
+        if not payment_tx:
+            raise HTTPException(status_code=404, detail="Payment transaction not found")
+        
+        if payment_tx.status == "PENDING":
+            created_at = payment_tx.createdAt
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            age = (datetime.now(timezone.utc) - created_at).total_seconds()
+            if age > CHECKOUT_STATUS_STRIPE_FALLBACK_SECONDS:
+                logger.info(f"Webhook overdue for session {session_id}, checking Stripe")
+                await reconcile_with_stripe(req, prisma, session_id)
+                payment_tx = await prisma.paymenttransaction.find_unique(
+                    where={"sessionId": session_id}
                 )
-                
-                # If payment is completed, create Purchase record
-                if new_status == "COMPLETED" and checkout_status.payment_status == "paid":
-                    metadata = checkout_status.metadata or {}
-                    sop_id = metadata.get("sop_id")
-                    creator_id = metadata.get("creator_id")
-                    
-                    if sop_id and creator_id:
-                        # Check if purchase already exists (prevent duplicates)
-                        existing_purchase = await prisma.purchase.find_first(
-                            where={
-                                "sopId": sop_id,
-                                "stripePaymentId": session_id
-                            }
-                        )
-                        
-                        if not existing_purchase:
-                            # Get buyer ID from user context or payment transaction
-                            user_context = get_optional_user_from_auth_header(authorization)
-                            buyer_id = None
-                            
-                            if user_context:
-                                buyer_id = user_context.user_id
-                            elif payment_tx and payment_tx.userId:
-                                buyer_id = payment_tx.userId
-                            
-                            # Only create purchase if we have a buyer ID
-                            # Guest purchases are not recorded in Purchase table
-                            if buyer_id:
-                                # Calculate fees (30% platform, 70% creator)
-                                total_amount = float(checkout_status.amount_total) / 100  # Convert from cents
-                                platform_fee = total_amount * 0.30
-                                creator_revenue = total_amount * 0.70
-                                
-                                # Create purchase record
-                                await prisma.purchase.create(
-                                    data={
-                                        "sopId": sop_id,
-                                        "buyerId": buyer_id,
-                                        "sellerId": creator_id,
-                                        "price": total_amount,
-                                        "platformFee": platform_fee,
-                                        "creatorRevenue": creator_revenue,
-                                        "stripePaymentId": session_id
-                                    }
-                                )
-                                logger.info(f"Purchase record created for SOP {sop_id} by user {buyer_id}")
-                            else:
-                                logger.info(f"Guest purchase completed for SOP {sop_id} - no Purchase record created")
-            
-            return checkout_status
-            
-        finally:
-            await prisma.disconnect()
-            
+        
+        checkout_status = build_checkout_status(payment_tx)
+        cache_checkout_status(session_id, checkout_status)
+        
+        return checkout_status
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -275,15 +315,45 @@ async def get_checkout_status(
 async def create_cart_checkout_session(
     request_data: CreateCartCheckoutRequest, 
     req: Request,
-    user: UserContext = Depends(get_current_user)
+    user: AuthUser = Depends(get_current_user),
+    prisma: Prisma = Depends(get_prisma)
 ):
     """
     Create a Stripe checkout session for multiple SOPs from cart
-    Requires authentication
+    Requires authentication. Prices and creators are read from the
+    database; the ones sent with the cart items are ignored.
     """
     try:
+        # Verify user_id matches authenticated user
+        if request_data.user_id != user.user_id:
+            raise HTTPException(
+                status_code=403, 
+                detail="Cannot create checkout for another user's cart"
+            )
+        
+        # Get SOP details, keeping the cart order and dropping repeats
+        sop_ids = list(dict.fromkeys(item.sop_id for item in request_data.cart_items))
+        if not sop_ids:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        
+        sops = await prisma.sop.find_many(where={"id": {"in": sop_ids}})
+        sops_by_id = {sop.id: sop for sop in sops}
+        
+        missing = [sop_id for sop_id in sop_ids if sop_id not in sops_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"SOP not found: {', '.join(missing)}")
+        
+        unavailable = [sop_id for sop_id in sop_ids if sops_by_id[sop_id].type != "MARKETPLACE"]
+        if unavailable:
+            raise HTTPException(
+                status_code=400,
+                detail=f"SOP is not available for purchase: {', '.join(unavailable)}"
+            )
+        
+        cart_sops = [sops_by_id[sop_id] for sop_id in sop_ids]
+        
         # Calculate total amount
-        total_amount = sum(item.sop_price for item in request_data.cart_items) / 100.0  # Convert to dollars
+        total_amount = sum(float(sop.price or 0) for sop in cart_sops) / 100.0  # Convert to dollars
         
         if total_amount <= 0:
             raise HTTPException(status_code=400, detail="Cart total must be greater than 0")
@@ -292,25 +362,16 @@ async def create_cart_checkout_session(
         success_url = f"{request_data.origin_url}/purchase-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{request_data.origin_url}/cart"
         
-        # Verify user_id matches authenticated user
-        if request_data.user_id != user.user_id:
-            raise HTTPException(
-                status_code=403, 
-                detail="Cannot create checkout for another user's cart"
-            )
-        
         # Metadata to track this purchase
         metadata = {
             "user_id": user.user_id,
-            "cart_items": ",".join([item.sop_id for item in request_data.cart_items]),
-            "item_count": str(len(request_data.cart_items)),
+            "cart_items": ",".join(sop_ids),
+            "item_count": str(len(sop_ids)),
             "source": "cart_checkout"
         }
         
-        # Initialize Stripe checkout
-        host_url = str(req.base_url)
-        webhook_url = f"{host_url}api/stripe/webhook"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        # Get Stripe checkout client
+        stripe_checkout = get_stripe_checkout(req)
         
         # Create checkout session request
         checkout_request = CheckoutSessionRequest(
@@ -325,27 +386,33 @@ async def create_cart_checkout_session(
         session = await stripe_checkout.create_checkout_session(checkout_request)
         
         # Store payment transaction in database
-        from prisma import Prisma
-        prisma = Prisma()
-        await prisma.connect()
-        
-        try:
-            import json
-            await prisma.paymenttransaction.create(
-                data={
-                    "sessionId": session.session_id,
-                    "amount": total_amount,
-                    "currency": "usd",
-                    "status": "PENDING",
-                    "metadata": json.dumps(metadata),
-                    "userId": user.user_id,
-                    "userEmail": user.email
+        # Per-item prices and creators are kept locally for fulfillment,
+        # Stripe metadata values are limited to 500 characters
+        import json
+        stored_metadata = {
+            **metadata,
+            "items": [
+                {
+                    "sop_id": sop.id,
+                    "creator_id": sop.creatorId,
+                    "price": float(sop.price or 0)
                 }
-            )
-        finally:
-            await prisma.disconnect()
+                for sop in cart_sops
+            ]
+        }
+        await prisma.paymenttransaction.create(
+            data={
+                "sessionId": session.session_id,
+                "amount": total_amount,
+                "currency": "usd",
+                "status": "PENDING",
+                "metadata": json.dumps(stored_metadata),
+                "userId": user.user_id,
+                "userEmail": user.email
+            }
+        )
         
-        logger.info(f"Created cart checkout session {session.session_id} for {len(request_data.cart_items)} items")
+        logger.info(f"Created cart checkout session {session.session_id} for {len(cart_sops)} items")
         
         return session
         
@@ -357,7 +424,11 @@ async def create_cart_checkout_session(
 
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, stripe_signature: Optional[str] = Header(None)):
+async def stripe_webhook(
+    request: Request,
+    stripe_signature: Optional[str] = Header(None),
+    prisma: Prisma = Depends(get_prisma)
+):
     """
     Handle Stripe webhook events
     """
@@ -367,10 +438,8 @@ async def stripe_webhook(request: Request, stripe_signature: Optional[str] = Hea
         if not stripe_signature:
             raise HTTPException(status_code=400, detail="Missing Stripe-Signature header")
         
-        # Initialize Stripe checkout
-        host_url = str(request.base_url)
-        webhook_url = f"{host_url}api/stripe/webhook"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        # Get Stripe checkout client
+        stripe_checkout = get_stripe_checkout(request)
         
         # Handle webhook
         webhook_response = await stripe_checkout.handle_webhook(
@@ -380,26 +449,56 @@ async def stripe_webhook(request: Request, stripe_signature: Optional[str] = Hea
         
         logger.info(f"Webhook received: {webhook_response.event_type} for session {webhook_response.session_id}")
         
-        # Update payment transaction based on webhook
-        if webhook_response.event_type == "checkout.session.completed":
-            from prisma import Prisma
-            
-            prisma = Prisma()
-            await prisma.connect()
-            
-            try:
-                await prisma.paymenttransaction.update(
-                    where={"sessionId": webhook_response.session_id},
-                    data={
-                        "status": "COMPLETED",
-                        "paymentStatus": webhook_response.payment_status
-                    }
-                )
-            finally:
-                await prisma.disconnect()
+        # Persist the event; Stripe retries reuse the event id, so duplicates are dropped here
+        import json
+        try:
+            await prisma.stripewebhookevent.create(
+                data={
+                    "id": webhook_response.event_id,
+                    "type": webhook_response.event_type,
+                    "sessionId": webhook_response.session_id,
+                    "paymentStatus": webhook_response.payment_status,
+                    "payload": json.dumps({"metadata": webhook_response.metadata or {}})
+                }
+            )
+        except UniqueViolationError:
+            logger.info(f"Duplicate webhook event {webhook_response.event_id} ignored")
+            return {"received": True, "duplicate": True}
+        
+        # Acknowledge immediately and let the worker pool update the database
+        request.app.state.webhook_workers.enqueue(webhook_response.event_id)
         
         return {"received": True}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def process_webhook_event(prisma: Prisma, event: StripeWebhookEvent):
+    """
+    Apply a persisted webhook event to the database and fulfil the checkout
+    Raising makes the worker pool retry the event
+    """
+    if event.type in ("checkout.session.completed", "checkout.session.async_payment_succeeded"):
+        await fulfill_checkout(prisma, event.sessionId, event.paymentStatus)
+    elif event.type == "checkout.session.expired":
+        await expire_checkout(prisma, event.sessionId)
+    else:
+        return
+    
+    invalidate_checkout_status(event.sessionId)
+
+
+def create_webhook_worker_pool(prisma: Prisma) -> WebhookWorkerPool:
+    """Build the worker pool that processes persisted webhook events"""
+    return WebhookWorkerPool(
+        prisma,
+        process_webhook_event,
+        workers=WEBHOOK_WORKERS,
+        max_attempts=WEBHOOK_MAX_ATTEMPTS,
+        retry_base_delay=WEBHOOK_RETRY_BASE_DELAY,
+        sweep_interval=WEBHOOK_SWEEP_INTERVAL
+    )
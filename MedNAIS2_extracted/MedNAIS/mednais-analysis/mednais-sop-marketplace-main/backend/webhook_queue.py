@@ -0,0 +1,211 @@
+"""
+Background processing of persisted Stripe webhook events
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+from prisma import Prisma
+from prisma.models import StripeWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[Prisma, StripeWebhookEvent], Awaitable[None]]
+
+
+class WebhookWorkerPool:
+    """
+    Pool of asyncio workers that process webhook events from the event log
+
+    Events are claimed by flipping their status to PROCESSING, so a row is
+    handled by one worker even when several backend processes share the
+    table. Failed events are retried with exponential backoff and moved to
+    DEAD once max_attempts is reached. A sweep every sweep_interval seconds
+    re-queues events that were left behind: PROCESSING rows untouched for
+    stale_after seconds (their worker died) and PENDING or FAILED rows that
+    are no longer queued or waiting for a retry.
+    """
+
+    def __init__(
+        self,
+        prisma: Prisma,
+        handler: EventHandler,
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_base_delay: float = 2.0,
+        stale_after: float = 300.0,
+        sweep_interval: float = 60.0,
+    ):
+        self.prisma = prisma
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._retry_handles: set[asyncio.TimerHandle] = set()
+
+    async def start(self):
+        """Start the workers and re-queue events left unfinished by a previous run"""
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"webhook-worker-{index}"))
+        await self._recover()
+        self._sweeper = asyncio.create_task(self._sweep(), name="webhook-sweeper")
+        logger.info(f"Started {self.workers} webhook workers")
+
+    async def stop(self):
+        """
+        Cancel the workers; unfinished events are recovered on next start
+        Events interrupted mid-handler are set back to FAILED
+        """
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def enqueue(self, event_id: str):
+        """Schedule a persisted event for processing"""
+        self._queue.put_nowait(event_id)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize(),
+            "retries_scheduled": len(self._retry_handles),
+        }
+
+    async def _recover(self, startup: bool = True):
+        """
+        Re-queue unfinished events
+        On startup every PENDING or FAILED event is queued; later sweeps only
+        pick up the ones untouched for stale_after seconds, so events that are
+        queued or waiting for a retry are left to it
+        """
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)
+        # Events stuck in PROCESSING belonged to a worker that died mid-event
+        await self.prisma.stripewebhookevent.update_many(
+            where={"status": "PROCESSING", "updatedAt": {"lt": stale_before}},
+            data={"status": "FAILED", "lastError": "Processing interrupted"}
+        )
+        where = {"status": {"in": ["PENDING", "FAILED"]}}
+        if not startup:
+            where["updatedAt"] = {"lt": stale_before}
+        pending = await self.prisma.stripewebhookevent.find_many(
+            where=where,
+            order={"createdAt": "asc"}
+        )
+        for event in pending:
+            self.enqueue(event.id)
+        if pending:
+            logger.info(f"Re-queued {len(pending)} unfinished webhook events")
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self._recover(startup=False)
+            except Exception as e:
+                logger.error(f"Webhook sweep failed: {e}")
+
+    async def _worker(self):
+        while True:
+            event_id = await self._queue.get()
+            try:
+                await self._process(event_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook worker error for event {event_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, event_id: str):
+        # Claim the event; a zero count means it was already handled elsewhere
+        claimed = await self.prisma.stripewebhookevent.update_many(
+            where={"id": event_id, "status": {"in": ["PENDING", "FAILED"]}},
+            data={"status": "PROCESSING", "attempts": {"increment": 1}}
+        )
+        if not claimed:
+            return
+
+        try:
+            await self._handle(event_id)
+        except asyncio.CancelledError:
+            await self._release(event_id, "Processing interrupted")
+            raise
+        except Exception as e:
+            await self._release(event_id, str(e))
+            raise
+
+    async def _release(self, event_id: str, error: str):
+        """Hand a claimed event back as FAILED so a sweep or the next start retries it"""
+        try:
+            await self.prisma.stripewebhookevent.update_many(
+                where={"id": event_id, "status": "PROCESSING"},
+                data={"status": "FAILED", "lastError": error[:1000]}
+            )
+        except Exception as e:
+            # Left in PROCESSING; the sweep recovers it once it is stale
+            logger.error(f"Could not release webhook event {event_id}: {e}")
+
+    async def _handle(self, event_id: str):
+        event = await self.prisma.stripewebhookevent.find_unique(where={"id": event_id})
+        if event is None:
+            return
+
+        try:
+            await self.handler(self.prisma, event)
+        except Exception as e:
+            await self._record_failure(event, e)
+            return
+
+        await self.prisma.stripewebhookevent.update(
+            where={"id": event_id},
+            data={
+                "status": "PROCESSED",
+                "processedAt": datetime.now(timezone.utc),
+                "lastError": None
+            }
+        )
+        logger.info(f"Processed webhook event {event_id} ({event.type})")
+
+    async def _record_failure(self, event: StripeWebhookEvent, error: Exception):
+        dead = event.attempts >= self.max_attempts
+        await self.prisma.stripewebhookevent.update(
+            where={"id": event.id},
+            data={"status": "DEAD" if dead else "FAILED", "lastError": str(error)[:1000]}
+        )
+
+        if dead:
+            logger.error(
+                f"Webhook event {event.id} ({event.type}) dead-lettered "
+                f"after {event.attempts} attempts: {error}"
+            )
+            return
+
+        delay = self.retry_base_delay * (2 ** (event.attempts - 1))
+        logger.warning(
+            f"Webhook event {event.id} failed (attempt {event.attempts}), "
+            f"retrying in {delay:.0f}s: {error}"
+        )
+        self._schedule_retry(event.id, delay)
+
+    def _schedule_retry(self, event_id: str, delay: float):
+        handle: Optional[asyncio.TimerHandle] = None
+
+        def requeue():
+            self._retry_handles.discard(handle)
+            self.enqueue(event_id)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retry_handles.add(handle)
@@ -0,0 +1,22 @@
+-- CreateTable
+CREATE TABLE "stripe_webhook_events" (
+    "id" TEXT NOT NULL,
+    "type" TEXT NOT NULL,
+    "session_id" TEXT,
+    "payment_status" TEXT,
+    "payload" JSONB,
+    "status" TEXT NOT NULL DEFAULT 'PENDING',
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "last_error" TEXT,
+    "processed_at" TIMESTAMP(3),
+    "created_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "stripe_webhook_events_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "stripe_webhook_events_status_idx" ON "stripe_webhook_events"("status");
+
+-- CreateIndex
+CREATE INDEX "stripe_webhook_events_session_id_idx" ON "stripe_webhook_events"("session_id");
@@ -0,0 +1,9 @@
+-- Remove duplicate purchases recorded for the same checkout session, keeping the earliest
+DELETE FROM "purchases" AS p
+USING "purchases" AS q
+WHERE p."stripePaymentId" = q."stripePaymentId"
+  AND p."sopId" = q."sopId"
+  AND (p."createdAt", p."id") > (q."createdAt", q."id");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "purchases_stripePaymentId_sopId_key" ON "purchases"("stripePaymentId", "sopId");
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for process_document.py
+
+Imports the module in fresh interpreters with -X importtime and reports the
+wall-clock import time and the slowest imports made by the script itself.
+
+Usage:
+    python scripts/bench_startup.py [runs] [top]
+"""
+import os
+import re
+import sys
+import time
+import statistics
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def import_once():
+    """Import process_document in a fresh interpreter; returns (seconds, -X importtime output)"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import process_document'],
+        cwd=SCRIPTS_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return time.perf_counter() - started, result.stderr
+
+
+def script_imports(importtime_output, module='process_document'):
+    """(cumulative microseconds, name) for the imports made directly by module"""
+    children = []
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        # importtime prints children (indented two more spaces) before their parent
+        depth = len(match.group(3))
+        if depth == 3:
+            children.append((int(match.group(2)), match.group(4)))
+        elif depth == 1:
+            if match.group(4) == module:
+                return sorted(children, reverse=True)
+            children = []
+    return []
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    timings = []
+    output = ""
+    for _ in range(runs):
+        seconds, output = import_once()
+        timings.append(seconds)
+
+    print(f"import process_document: median {statistics.median(timings) * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms over {runs} runs (includes interpreter startup)")
+    print()
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative, module in script_imports(output)[:top]:
+        print(f"{cumulative / 1000:14.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
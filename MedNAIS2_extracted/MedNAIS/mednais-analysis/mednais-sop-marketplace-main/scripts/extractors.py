@@ -0,0 +1,506 @@
+"""
+Text extraction for uploaded documents
+
+Each format is an extractor class registered with @register_extractor. The
+file's first bytes decide which one handles it (the declared MIME type and
+extension are only used for text formats, which have no signature), so a
+mislabelled upload is still read correctly and an unknown binary is rejected
+before any parser runs.
+
+Format libraries (PyPDF2, python-docx, openpyxl, Pillow) are imported inside
+the extractor that needs them, so processing a plain text file never loads them.
+"""
+import io
+import os
+import re
+import zipfile
+import threading
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+# Bump when extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = "6"
+
+# Characters of document text sent to the LLM; extraction stops once it has this many (0 = no limit)
+EXTRACT_MAX_CHARS = int(os.getenv('EXTRACT_MAX_CHARS', '120000'))
+
+# Bytes read from the start of a file to detect its format
+SNIFF_BYTES = 8192
+
+# Parallel PDF extraction: worker processes (0 = serial), minimum page count, pages per task
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '0'))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '64'))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '16'))
+
+# Excel sampling: rows read per sheet after the header, and total cells read across sheets
+EXCEL_MAX_ROWS_PER_SHEET = int(os.getenv('EXCEL_MAX_ROWS_PER_SHEET', '200'))
+EXCEL_MAX_CELLS = int(os.getenv('EXCEL_MAX_CELLS', '50000'))
+
+# Text files with more than this share of control characters are treated as binary
+TEXT_MAX_CONTROL_RATIO = 0.05
+# Control characters that do occur in text: tab, newline, vertical tab, form feed, carriage return
+TEXT_CONTROL_BYTES = bytes(range(0x20)).translate(None, b'\t\n\x0b\x0c\r') + b'\x7f'
+
+# Legacy binary Office files (.doc, .xls, .ppt); none of our parsers read them
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Created on first use and kept for the life of the process
+pdf_pool = None
+# The backend extracts from several worker threads at once
+pdf_pool_lock = threading.Lock()
+
+# Checked in registration order
+EXTRACTORS = []
+
+class FileSignature:
+    """What the first bytes of a file say about its format"""
+
+    def __init__(self, head, zip_names=None):
+        self.head = head
+        # Member names when the file is a ZIP container (OOXML, OpenDocument)
+        self.zip_names = zip_names
+
+    @property
+    def is_text(self):
+        """True if the file looks like text in some encoding (see text_encoding)"""
+        return text_encoding(self.head) is not None
+
+def text_encoding(head):
+    """
+    Encoding to read a file starting with head as text, or None if it looks binary
+    A BOM wins; otherwise UTF-8 if the bytes are valid UTF-8 (ignoring a
+    character cut off at the end), else Windows-1252, which legacy files use.
+    NUL bytes or many control characters mean binary
+    """
+    if head.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+    if b'\x00' in head:
+        return None
+    if head and len(head.translate(None, TEXT_CONTROL_BYTES)) < len(head) * (1 - TEXT_MAX_CONTROL_RATIO):
+        return None
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            return 'cp1252'
+    return 'utf-8'
+
+def read_signature(file):
+    """Read the start of an open binary file (and its ZIP directory) and rewind it"""
+    head = file.read(SNIFF_BYTES)
+    zip_names = None
+    if head.startswith(b'PK\x03\x04'):
+        file.seek(0)
+        try:
+            with zipfile.ZipFile(file) as archive:
+                zip_names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            pass
+    file.seek(0)
+    return FileSignature(head, zip_names)
+
+class Extractor:
+    """
+    Extracts text from one document format
+
+    Binary formats override sniff() and are only chosen when the signature
+    matches. Text formats can't be sniffed reliably and are chosen by MIME
+    type or extension, provided the file actually looks like text.
+    """
+    content_type = 'text'
+    mime_types = ()
+    mime_prefixes = ()
+    extensions = ()
+
+    def sniff(self, signature):
+        """True if the file signature identifies this format"""
+        return False
+
+    def matches_name(self, file_path, mime_type):
+        """True if the declared MIME type or the file extension names this format"""
+        return (
+            mime_type in self.mime_types
+            or mime_type.startswith(self.mime_prefixes)
+            or file_path.lower().endswith(self.extensions)
+        )
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        """Text of the file, read from the open binary handle"""
+        raise NotImplementedError
+
+def register_extractor(cls):
+    """Class decorator adding an extractor to the registry"""
+    EXTRACTORS.append(cls())
+    return cls
+
+def find_extractor(signature, file_path, mime_type):
+    """
+    Extractor for a file, or None if it is a binary format we can't read
+    A matching signature wins; otherwise text files go to the text extractor
+    named by their MIME type or extension, then to plain text
+    """
+    for extractor in EXTRACTORS:
+        if extractor.sniff(signature):
+            return extractor
+
+    if not signature.is_text:
+        return None
+
+    text_extractors = [extractor for extractor in EXTRACTORS if isinstance(extractor, TextExtractor)]
+    for extractor in text_extractors:
+        if extractor.matches_name(file_path, mime_type):
+            return extractor
+    return PLAIN_TEXT
+
+def take_chars(chunks, max_chars=EXTRACT_MAX_CHARS):
+    """
+    Join text chunks, stopping once max_chars characters have been collected
+    Chunks are pulled lazily, so a generator source is not read past the budget
+    """
+    parts = []
+    total = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        total += len(chunk)
+        if max_chars and total >= max_chars:
+            break
+    text = "".join(parts)
+    return text[:max_chars] if max_chars else text
+
+def iter_text_blocks(file, block_size=64 * 1024):
+    """Decode a binary file in blocks, in the encoding detected from its start"""
+    encoding = text_encoding(file.read(SNIFF_BYTES)) or 'utf-8'
+    file.seek(0)
+    reader = io.TextIOWrapper(file, encoding=encoding, errors='ignore')
+    try:
+        for block in iter(lambda: reader.read(block_size), ''):
+            yield block
+    finally:
+        # Don't let the wrapper close the caller's handle
+        reader.detach()
+
+def iter_xml_text(stream, text_tags, block_tags=()):
+    """
+    Yield the text of text_tags elements from an XML stream, one line per block_tags element
+    Elements are cleared as they are read, so large parts stay out of memory
+    """
+    line = []
+    for event, element in ElementTree.iterparse(stream, events=('end',)):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag in text_tags and element.text:
+            line.append(element.text)
+        if tag in block_tags:
+            text = "".join(line).strip()
+            line = []
+            if text:
+                yield text + "\n"
+            element.clear()
+    if line:
+        yield "".join(line) + "\n"
+
+@register_extractor
+class ImageExtractor(Extractor):
+    """Describes an image; the image itself is sent to GPT-5 Vision with the prompt"""
+    content_type = 'image'
+    mime_prefixes = ('image/',)
+    extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+    def sniff(self, signature):
+        head = signature.head
+        return (
+            head.startswith((b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a'))
+            or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+            # "BM", file size, then four reserved zero bytes
+            or (head[:2] == b'BM' and head[6:10] == b'\x00\x00\x00\x00')
+        )
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        from PIL import Image
+
+        try:
+            # Verify it's a valid image
+            with Image.open(file) as img:
+                return f"[Image file: {img.format}, Size: {img.size}]"
+        except Exception as e:
+            return f"Error reading image: {str(e)}"
+
+def iter_pdf_pages(pdf_reader):
+    """Yield the text of each PDF page in order"""
+    for page in pdf_reader.pages:
+        yield (page.extract_text() or "") + "\n"
+
+def extract_pdf_page_range(file_path, start, stop):
+    """Text of pages [start, stop) of a PDF; runs in a pool worker"""
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return "".join((pdf_reader.pages[i].extract_text() or "") + "\n" for i in range(start, stop))
+
+def get_pdf_pool():
+    """Shared process pool for PDF extraction"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global pdf_pool
+    with pdf_pool_lock:
+        if pdf_pool is None:
+            # spawn: forking a process that runs threads (the backend) is unsafe
+            pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return pdf_pool
+
+def iter_pdf_page_ranges(file_path, page_count):
+    """
+    Yield the text of consecutive page ranges, extracted in the process pool
+    Ranges are yielded in page order; ranges not yet started when the
+    consumer stops are cancelled
+    """
+    pool = get_pdf_pool()
+    futures = [
+        pool.submit(extract_pdf_page_range, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+@register_extractor
+class PdfExtractor(Extractor):
+    """
+    Reads only as many pages as max_chars needs
+    PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split across
+    PDF_WORKERS processes when enabled
+    """
+    mime_types = ('application/pdf',)
+    extensions = ('.pdf',)
+
+    def sniff(self, signature):
+        if signature.head.lstrip().startswith(b'%PDF-'):
+            return True
+        # Readers tolerate a little binary junk before the header; in a text
+        # file "%PDF-" is just something the text mentions
+        return not signature.is_text and b'%PDF-' in signature.head[:1024]
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        import PyPDF2
+
+        try:
+            pdf_reader = PyPDF2.PdfReader(file)
+            page_count = len(pdf_reader.pages)
+            if PDF_WORKERS < 2 or page_count < PDF_PARALLEL_MIN_PAGES:
+                return take_chars(iter_pdf_pages(pdf_reader), max_chars)
+
+            return take_chars(iter_pdf_page_ranges(file_path, page_count), max_chars)
+        except Exception as e:
+            return f"Error reading PDF: {str(e)}"
+
+@register_extractor
+class DocxExtractor(Extractor):
+    mime_types = ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',)
+    extensions = ('.docx',)
+
+    def sniff(self, signature):
+        return signature.zip_names is not None and 'word/document.xml' in signature.zip_names
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        from docx import Document as DocxDocument
+
+        try:
+            doc = DocxDocument(file)
+            return take_chars((paragraph.text + "\n" for paragraph in doc.paragraphs), max_chars)
+        except Exception as e:
+            return f"Error reading Word document: {str(e)}"
+
+def iter_excel_rows(wb, max_rows_per_sheet=EXCEL_MAX_ROWS_PER_SHEET, max_cells=EXCEL_MAX_CELLS):
+    """
+    Yield each sheet's heading and its header plus first max_rows_per_sheet rows
+    Stops entirely once max_cells cells have been read
+    """
+    cells = 0
+    for sheet_name in wb.sheetnames:
+        ws = wb[sheet_name]
+        yield f"\n=== Sheet: {sheet_name} ===\n"
+        rows = 0
+        for row in ws.iter_rows(values_only=True):
+            cells += len(row)
+            row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
+            if row_text.strip():
+                yield row_text + "\n"
+                rows += 1
+            if max_cells and cells >= max_cells:
+                return
+            # Header row plus the sample
+            if max_rows_per_sheet and rows > max_rows_per_sheet:
+                break
+
+@register_extractor
+class ExcelExtractor(Extractor):
+    """Bounded sample of each sheet"""
+    mime_types = ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',)
+    extensions = ('.xlsx',)
+
+    def sniff(self, signature):
+        return signature.zip_names is not None and 'xl/workbook.xml' in signature.zip_names
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        from openpyxl import load_workbook
+
+        try:
+            wb = load_workbook(file, read_only=True, data_only=True)
+            try:
+                return take_chars(iter_excel_rows(wb), max_chars)
+            finally:
+                # Read-only workbooks keep the file open until closed
+                wb.close()
+        except Exception as e:
+            return f"Error reading Excel file: {str(e)}"
+
+@register_extractor
+class PptxExtractor(Extractor):
+    """Text of each slide in order, read straight from the slide XML"""
+    mime_types = ('application/vnd.openxmlformats-officedocument.presentationml.presentation',)
+    extensions = ('.pptx',)
+
+    def sniff(self, signature):
+        return signature.zip_names is not None and 'ppt/presentation.xml' in signature.zip_names
+
+    def iter_slides(self, archive):
+        slides = [name for name in archive.namelist() if re.fullmatch(r'ppt/slides/slide\d+\.xml', name)]
+        slides.sort(key=lambda name: int(re.search(r'\d+', name).group()))
+        for number, name in enumerate(slides, start=1):
+            yield f"\n=== Slide {number} ===\n"
+            with archive.open(name) as stream:
+                yield from iter_xml_text(stream, {'t'}, {'p'})
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        try:
+            with zipfile.ZipFile(file) as archive:
+                return take_chars(self.iter_slides(archive), max_chars)
+        except Exception as e:
+            return f"Error reading PowerPoint file: {str(e)}"
+
+@register_extractor
+class OdtExtractor(Extractor):
+    """Paragraphs and headings of an OpenDocument text file"""
+    mime_types = ('application/vnd.oasis.opendocument.text',)
+    extensions = ('.odt',)
+
+    def sniff(self, signature):
+        # The uncompressed "mimetype" entry comes first in every OpenDocument file
+        head = signature.head
+        return head[30:38] == b'mimetype' and head[38:77] == b'application/vnd.oasis.opendocument.text'
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        try:
+            with zipfile.ZipFile(file) as archive, archive.open('content.xml') as stream:
+                # Text inside spans and links is gathered from the enclosing paragraph
+                paragraphs = (
+                    "".join(element.itertext()).strip() + "\n"
+                    for event, element in ElementTree.iterparse(stream, events=('end',))
+                    if element.tag.rsplit('}', 1)[-1] in ('p', 'h')
+                )
+                return take_chars((paragraph for paragraph in paragraphs if paragraph.strip()), max_chars)
+        except Exception as e:
+            return f"Error reading OpenDocument file: {str(e)}"
+
+@register_extractor
+class LegacyOfficeExtractor(Extractor):
+    """Rejects .doc/.xls/.ppt files up front with a useful message"""
+
+    def sniff(self, signature):
+        return signature.head.startswith(OLE2_SIGNATURE)
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        return "Error: legacy Office formats (.doc, .xls, .ppt) are not supported, save the file as .docx, .xlsx or .pptx"
+
+class TextExtractor(Extractor):
+    """Base for formats read as text (UTF-8, UTF-16 with a BOM, or Windows-1252)"""
+
+    def iter_text(self, file):
+        return iter_text_blocks(file)
+
+    def extract(self, file, file_path, max_chars=EXTRACT_MAX_CHARS):
+        return take_chars(self.iter_text(file), max_chars)
+
+class HTMLTextParser(HTMLParser):
+    """Collects visible text, one line per block element"""
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'table'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        # Keep heading levels so the chunker can split on them
+        if tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6') and not self.skip_depth:
+            self.parts.append("#" * int(tag[1]) + " ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def drain(self):
+        """Text collected since the last call, with blank runs collapsed"""
+        text = re.sub(r'[ \t]*\n\s*', "\n", "".join(self.parts))
+        self.parts = []
+        return text
+
+@register_extractor
+class HtmlExtractor(TextExtractor):
+    mime_types = ('text/html', 'application/xhtml+xml')
+    extensions = ('.html', '.htm', '.xhtml')
+
+    def sniff(self, signature):
+        start = signature.head[:512].lstrip().lower()
+        return start.startswith((b'<!doctype html', b'<html'))
+
+    def iter_text(self, file):
+        parser = HTMLTextParser()
+        for block in iter_text_blocks(file):
+            parser.feed(block)
+            yield parser.drain()
+        parser.close()
+        yield parser.drain()
+
+@register_extractor
+class MarkdownExtractor(TextExtractor):
+    """Read as-is; headings already mark the sections the chunker splits on"""
+    mime_types = ('text/markdown', 'text/x-markdown')
+    extensions = ('.md', '.markdown')
+
+@register_extractor
+class PlainTextExtractor(TextExtractor):
+    mime_prefixes = ('text/',)
+    extensions = ('.txt',)
+
+PLAIN_TEXT = next(extractor for extractor in EXTRACTORS if isinstance(extractor, PlainTextExtractor))
+
+def extract_content(file_path, mime_type):
+    """Extract content based on the file's signature, returning (content, content_type)"""
+    mime_type = mime_type or ''
+    with open(file_path, 'rb') as file:
+        signature = read_signature(file)
+        extractor = find_extractor(signature, file_path, mime_type)
+        if extractor is None:
+            return f"Error: unsupported file type ({mime_type or 'unknown'})", 'text'
+        return extractor.extract(file, file_path), extractor.content_type
@@ -0,0 +1,173 @@
+"""
+Rate-aware scheduler for outbound LLM calls
+
+Every generation request in the process waits here for a slot. A slot is
+granted when fewer than max_concurrency calls are running and both token
+buckets (requests per minute, estimated tokens per minute) can pay for the
+call. Waiting calls are served by priority, then in arrival order. A 429 from
+the provider pauses all dispatching for the backoff delay, so queued calls
+don't pile onto a limit that has just been hit.
+"""
+import sys
+import time
+import heapq
+import random
+import asyncio
+import itertools
+
+# Lower runs first; paying creators are served ahead of everyone else
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+def is_rate_limit_error(error):
+    """True if an LLM client exception is a provider rate limit (HTTP 429)"""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    if 'RateLimit' in type(error).__name__:
+        return True
+    if getattr(getattr(error, 'response', None), 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    # Not a bare "429": request ids and byte counts can contain it
+    return 'rate limit' in message or 'too many requests' in message
+
+def estimate_tokens(*texts, output_tokens=0, images=0):
+    """Rough token count for a request: ~4 characters per token, plus expected output and images"""
+    return sum(len(text) for text in texts) // 4 + output_tokens + images * 1500
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute, holding at most a minute's worth"""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until amount can be taken (0 if it can be taken now)"""
+        self._refill()
+        # A request bigger than the bucket would never fit; let it through once full
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+class LlmScheduler:
+    """
+    Process-wide gate for LLM calls
+
+    run(call, tokens, priority) waits for a slot, awaits call() and retries
+    it with exponential backoff (with jitter) while the provider answers 429.
+    A rate of 0 disables that bucket.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        requests_per_minute=60,
+        tokens_per_minute=150000,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_max=60.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.paused_until = 0.0
+        self.active = 0
+        self.rate_limited = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._condition = None
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": len(self._waiting),
+            "rate_limited": self.rate_limited,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 1),
+        }
+
+    def _delay(self, tokens):
+        delays = [self.paused_until - time.monotonic()]
+        if self.requests:
+            delays.append(self.requests.delay(1))
+        if self.tokens:
+            delays.append(self.tokens.delay(tokens))
+        return max(delays)
+
+    async def acquire(self, tokens, priority="normal"):
+        """Wait until this call may start; pair with release()"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        entry = (PRIORITIES.get(priority, PRIORITIES["normal"]), next(self._counter))
+        heapq.heappush(self._waiting, entry)
+
+        async with self._condition:
+            try:
+                while True:
+                    delay = None
+                    if self._waiting[0] == entry and self.active < self.max_concurrency:
+                        delay = self._delay(tokens)
+                        if delay <= 0:
+                            break
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._waiting)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.active += 1
+            # The next caller in line may be able to start too
+            self._condition.notify_all()
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    async def _pause(self, delay):
+        async with self._condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+
+    async def run(self, call, tokens=0, priority="normal"):
+        """Await call() in a slot, retrying on rate limits"""
+        attempt = 0
+        while True:
+            await self.acquire(tokens, priority)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                error = e
+            finally:
+                await self.release()
+
+            self.rate_limited += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            print(f"LLM rate limited, retrying in {delay:.1f}s (attempt {attempt}): {error}", file=sys.stderr)
+            await self._pause(delay)
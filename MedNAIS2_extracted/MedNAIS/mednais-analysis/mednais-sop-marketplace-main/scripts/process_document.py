@@ -2,107 +2,201 @@
 import sys
 import json
 import os
+import re
 import asyncio
+import argparse
+import mimetypes
+import base64
+import time
+import uuid
+import io
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Import document processing libraries
-import PyPDF2
-from docx import Document as DocxDocument
-from openpyxl import load_workbook
-from PIL import Image
-import io
+# Format libraries and the LLM client are imported where they are used,
+# so a plain text file doesn't pay for loading them
+from document_cache import DiskCache, file_digest, make_key
+from extractors import EXTRACTOR_VERSION, EXTRACT_MAX_CHARS, extract_content
+from step_parser import StepStreamParser, parse_step_array
+from llm_scheduler import LlmScheduler, estimate_tokens
 
-# Import emergentintegrations
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+# Long documents are generated in chunks of SOP_CHUNK_CHARS, SOP_CHUNK_CONCURRENCY LLM calls at a time
+SOP_CHUNK_CHARS = int(os.getenv('SOP_CHUNK_CHARS', '8000'))
+SOP_CHUNK_CONCURRENCY = int(os.getenv('SOP_CHUNK_CONCURRENCY', '4'))
+# Merged chunk steps beyond this are consolidated by one more LLM call
+SOP_MAX_STEPS = int(os.getenv('SOP_MAX_STEPS', '30'))
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF file"""
-    try:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        return f"Error reading PDF: {str(e)}"
+# Section boundaries: markdown headings, sheet markers, "2.1 Title" numbering, ALL CAPS lines
+HEADING_PATTERN = re.compile(r'^(#{1,6}\s+\S|=== .+ ===$|\d+(\.\d+)*\.?\s+[A-Z]|[A-Z][A-Z0-9 ,/&()-]{3,}$)')
 
-def extract_text_from_docx(file_path):
-    """Extract text from Word document"""
-    try:
-        doc = DocxDocument(file_path)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text
-    except Exception as e:
-        return f"Error reading Word document: {str(e)}"
+# Images are downscaled to fit IMAGE_MAX_DIMENSION pixels and re-encoded as JPEG before upload
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '1568'))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
 
-def extract_text_from_excel(file_path):
-    """Extract text from Excel file"""
-    try:
-        wb = load_workbook(file_path, read_only=True)
-        text = ""
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            text += f"\n=== Sheet: {sheet_name} ===\n"
-            for row in ws.iter_rows(values_only=True):
-                row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                if row_text.strip():
-                    text += row_text + "\n"
-        return text
-    except Exception as e:
-        return f"Error reading Excel file: {str(e)}"
+# Extracted-text cache (set EXTRACT_CACHE_MAX_MB=0 to disable)
+EXTRACT_CACHE_DIR = os.getenv('EXTRACT_CACHE_DIR', '/tmp/mednais-cache/extract')
+EXTRACT_CACHE_MAX_BYTES = int(float(os.getenv('EXTRACT_CACHE_MAX_MB', '256')) * 1024 * 1024)
 
-def extract_text_from_image(file_path):
-    """For images, we'll send the file path and let GPT-5 Vision handle it"""
-    try:
-        # Verify it's a valid image
-        img = Image.open(file_path)
-        return f"[Image file: {img.format}, Size: {img.size}]"
-    except Exception as e:
-        return f"Error reading image: {str(e)}"
-
-def extract_content(file_path, mime_type):
-    """Extract content based on file type"""
-    file_path_lower = file_path.lower()
-    
-    if mime_type.startswith('image/') or file_path_lower.endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
-        return extract_text_from_image(file_path), 'image'
-    elif mime_type == 'application/pdf' or file_path_lower.endswith('.pdf'):
-        return extract_text_from_pdf(file_path), 'text'
-    elif mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword'] or file_path_lower.endswith(('.docx', '.doc')):
-        return extract_text_from_docx(file_path), 'text'
-    elif mime_type in ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'application/vnd.ms-excel'] or file_path_lower.endswith(('.xlsx', '.xls')):
-        return extract_text_from_excel(file_path), 'text'
-    elif mime_type.startswith('text/') or file_path_lower.endswith('.txt'):
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read(), 'text'
-    else:
-        # Try as text by default
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                return f.read(), 'text'
-        except:
-            return f"Unsupported file type: {mime_type}", 'text'
+extract_cache = DiskCache(EXTRACT_CACHE_DIR, EXTRACT_CACHE_MAX_BYTES) if EXTRACT_CACHE_MAX_BYTES > 0 else None
+
+# LLM used for generation; SOP_LLM_BACKEND=stub returns canned steps without network calls
+LLM_BACKEND = os.getenv('SOP_LLM_BACKEND', 'emergent')
+LLM_PROVIDER = os.getenv('SOP_LLM_PROVIDER', 'openai')
+LLM_MODEL = os.getenv('SOP_LLM_MODEL', 'gpt-5')
+
+# LLM response cache (set LLM_CACHE_TTL=0 to disable)
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', '/tmp/mednais-cache/llm')
+LLM_CACHE_MAX_BYTES = int(float(os.getenv('LLM_CACHE_MAX_MB', '64')) * 1024 * 1024)
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '86400'))
+
+llm_cache = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES) if LLM_CACHE_TTL > 0 and LLM_CACHE_MAX_BYTES > 0 else None
+
+# Limits for all LLM calls made by this process (set a rate to 0 to disable it)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', '150000'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+# Expected response size, counted against the token budget up front
+LLM_OUTPUT_TOKENS_ESTIMATE = int(os.getenv('LLM_OUTPUT_TOKENS_ESTIMATE', '2000'))
+
+llm_scheduler = LlmScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_retries=LLM_MAX_RETRIES
+)
+
+def prepare_image(file_path, max_dimension=IMAGE_MAX_DIMENSION, quality=IMAGE_JPEG_QUALITY):
+    """
+    Base64 JPEG of an image for the vision model
+    Applies the EXIF orientation and downscales so neither side exceeds max_dimension
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(file_path) as img:
+        img.draft('RGB', (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension))
+        
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto white instead of black
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def extract_content_cached(file_path, mime_type):
+    """
+    extract_content with a content-addressed cache
+    Retrying the same file (e.g. with another custom prompt) skips parsing
+    """
+    if extract_cache is None:
+        return extract_content(file_path, mime_type)
+    
+    key = make_key('extract', EXTRACTOR_VERSION, EXTRACT_MAX_CHARS, mime_type, file_digest(file_path))
+    cached = extract_cache.get(key)
+    if cached is not None:
+        return cached['content'], cached['content_type']
+    
+    content, content_type = extract_content(file_path, mime_type)
+    
+    # Don't cache failures, they may be transient
+    if content and not content.startswith("Error"):
+        extract_cache.set(key, {'content': content, 'content_type': content_type})
+    
+    return content, content_type
+
+class StubUserMessage:
+    """Message for StubLlmChat, so the stub backend runs without the LLM SDK installed"""
+    
+    def __init__(self, text, image_base64=None):
+        self.text = text
+        self.image_base64 = image_base64
+
+class StubLlmChat:
+    """
+    Offline stand-in for LlmChat, selected with SOP_LLM_BACKEND=stub
+    Turns the first lines of the prompt into steps so the pipeline can be
+    exercised without an API key
+    """
+    
+    def __init__(self, system_message):
+        self.system_message = system_message
+    
+    async def send_message(self, user_message):
+        lines = [line.strip() for line in user_message.text.splitlines() if line.strip()]
+        steps = [
+            {
+                "title": line[:60],
+                "description": line,
+                "timerSeconds": 0,
+                "references": []
+            }
+            for line in lines[:5]
+        ]
+        return json.dumps(steps)
+    
+    async def stream_message(self, user_message):
+        """Yield the response in small pieces, like a streaming client"""
+        response = await self.send_message(user_message)
+        for start in range(0, len(response), 16):
+            await asyncio.sleep(0)
+            yield response[start:start + 16]
 
-async def generate_sop_steps(content, content_type, file_path=None, custom_prompt=None):
-    """Use GPT-5 to generate SOP steps from content"""
+def create_chat(system_message):
+    """Create the chat client for the configured LLM backend"""
+    if LLM_BACKEND == 'stub':
+        return StubLlmChat(system_message)
+    
+    from emergentintegrations.llm.chat import LlmChat
     
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         raise Exception("OPENAI_API_KEY not found in environment variables")
     
-    # Use custom prompt instructions if provided
+    return LlmChat(
+        api_key=api_key,
+        session_id=f"sop-generation-{uuid.uuid4().hex}",
+        system_message=system_message
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+
+def create_user_message(prompt, image_base64=None):
+    """Build the user message for the configured LLM backend"""
+    if LLM_BACKEND == 'stub':
+        return StubUserMessage(prompt, image_base64)
+    
+    from emergentintegrations.llm.chat import UserMessage, ImageContent
+    
+    if image_base64:
+        return UserMessage(text=prompt, file_contents=[ImageContent(image_base64=image_base64)])
+    return UserMessage(text=prompt)
+
+def llm_cache_key(system_message, prompt, file_path=None):
+    """Cache key over the normalized prompt, system prompt and model"""
+    normalized_prompt = " ".join(prompt.split())
+    # The image itself is sent alongside the prompt, so include its bytes and encoding
+    image_digest = f"{file_digest(file_path)}:{IMAGE_MAX_DIMENSION}:{IMAGE_JPEG_QUALITY}" if file_path else ''
+    return make_key('llm', LLM_BACKEND, LLM_PROVIDER, LLM_MODEL, system_message, normalized_prompt, image_digest)
+
+def build_system_message(custom_prompt=None):
+    """System prompt for SOP generation, with custom instructions if provided"""
     if custom_prompt:
-        system_message = f"""You are an expert at creating Standard Operating Procedures (SOPs). 
+        return f"""You are an expert at creating Standard Operating Procedures (SOPs). 
 Your task is to analyze documents and convert them into clear, actionable SOP steps.
 
 {custom_prompt}"""
-    else:
-        system_message = """You are an expert at creating Standard Operating Procedures (SOPs). 
+    
+    return """You are an expert at creating Standard Operating Procedures (SOPs). 
 Your task is to analyze documents and convert them into clear, actionable SOP steps.
 
 Each step should have:
@@ -127,13 +221,236 @@ Important:
 - Be specific and actionable
 - Include timing when relevant
 - Make it easy to follow"""
+
+def report_steps(response, on_step):
+    """Pass each step of a complete response to on_step"""
+    for step in StepStreamParser().feed(response):
+        on_step(step)
+
+async def stream_response(chat, user_message, on_step):
+    """
+    Read a response from a streaming chat client, passing each step to on_step
+    as soon as its JSON object is complete
+    """
+    parser = StepStreamParser()
+    parts = []
+    async for text in chat.stream_message(user_message):
+        parts.append(text)
+        for step in parser.feed(text):
+            on_step(step)
+    return "".join(parts)
+
+def has_steps(response):
+    """True if a response holds at least one usable step; only those are cached"""
+    try:
+        return bool(parse_step_array(response))
+    except ValueError:
+        return False
+
+async def send_prompt(system_message, prompt, file_path=None, use_cache=True, on_step=None, priority="normal"):
+    """
+    Send one prompt to the LLM, answering from the response cache when possible
+    file_path, if given, is an image attached to the prompt
+    on_step, if given, receives each parsed step: token by token when the
+    chat client can stream, otherwise once the response is complete
+    Calls go through the shared scheduler; priority is "high", "normal" or "low"
+    Responses without any step (refusals, truncated output) are not cached,
+    so the same request asks the model again
+    """
+    cache_key = None
+    if use_cache and llm_cache is not None:
+        cache_key = llm_cache_key(system_message, prompt, file_path)
+        cached = llm_cache.get(cache_key)
+        if (
+            cached is not None
+            and time.time() - cached['created_at'] < LLM_CACHE_TTL
+            and has_steps(cached['response'])
+        ):
+            if on_step:
+                report_steps(cached['response'], on_step)
+            return cached['response']
     
-    # Initialize LLM Chat with GPT-5
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"sop-generation-{os.getpid()}",
-        system_message=system_message
-    ).with_model("openai", "gpt-5")
+    image_base64 = await asyncio.to_thread(prepare_image, file_path) if file_path else None
+    user_message = create_user_message(prompt, image_base64)
+    
+    streamed = False
+    reported = 0
+    
+    async def call():
+        nonlocal streamed
+        # Initialize LLM Chat with GPT-5 (a fresh session for every attempt)
+        chat = create_chat(system_message)
+        
+        # Send message and get response
+        if on_step and hasattr(chat, 'stream_message'):
+            streamed = True
+            attempt_steps = 0
+            
+            def report(step):
+                # A retried attempt streams from the start again; only pass on
+                # steps beyond those an earlier attempt already reported
+                nonlocal reported, attempt_steps
+                attempt_steps += 1
+                if attempt_steps > reported:
+                    reported = attempt_steps
+                    on_step(step)
+            
+            return await stream_response(chat, user_message, report)
+        return await chat.send_message(user_message)
+    
+    tokens = estimate_tokens(system_message, prompt, output_tokens=LLM_OUTPUT_TOKENS_ESTIMATE, images=1 if file_path else 0)
+    response = await llm_scheduler.run(call, tokens, priority)
+    if on_step and not streamed:
+        report_steps(response, on_step)
+    
+    if cache_key and has_steps(response):
+        llm_cache.set(cache_key, {'response': response, 'created_at': time.time()})
+    
+    return response
+
+def split_sections(text):
+    """Split text into sections that start at a heading or page break"""
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and (line.startswith('\f') or HEADING_PATTERN.match(line.strip())):
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+def chunk_text(text, max_chars=SOP_CHUNK_CHARS):
+    """
+    Split text into chunks of at most max_chars
+    Whole sections are packed together; only sections longer than a chunk
+    are cut, at line boundaries (or mid-line for very long lines)
+    """
+    pieces = []
+    for section in split_sections(text):
+        if len(section) <= max_chars:
+            pieces.append(section)
+            continue
+        for line in section.splitlines(keepends=True):
+            pieces.extend(line[i:i + max_chars] for i in range(0, len(line), max_chars))
+    
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            chunks.append("".join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def normalize_text(value):
+    """Lowercased words of a value, for duplicate detection"""
+    return re.sub(r'[^a-z0-9]+', ' ', str(value or '').lower()).strip()
+
+def step_key(step):
+    """
+    Normalized title, description and timer for duplicate detection
+    Protocols repeat titles ("Centrifuge") with different settings, so the
+    title alone doesn't make a step a duplicate
+    """
+    return (
+        normalize_text(step.get('title')),
+        normalize_text(step.get('description')),
+        step.get('timerSeconds') or 0
+    )
+
+def merge_steps(step_lists):
+    """
+    Concatenate per-chunk steps in document order, dropping steps repeated
+    from an earlier chunk (a chunk's own steps are kept as the LLM listed them)
+    A repeated step's references are added to the first occurrence
+    """
+    merged = []
+    seen = {}
+    for steps in step_lists:
+        chunk_seen = {}
+        for step in steps:
+            if not isinstance(step, dict):
+                continue
+            key = step_key(step)
+            existing = seen.get(key)
+            if existing is None:
+                chunk_seen.setdefault(key, step)
+                merged.append(step)
+                continue
+            references = list(existing.get('references') or [])
+            for reference in step.get('references') or []:
+                if reference not in references:
+                    references.append(reference)
+            if references:
+                existing['references'] = references
+        for key, step in chunk_seen.items():
+            seen.setdefault(key, step)
+    return merged
+
+async def generate_chunked_steps(chunks, system_message, use_cache=True, on_step=None, priority="normal"):
+    """
+    Map-reduce generation for documents longer than one chunk
+    Chunks are sent concurrently (at most SOP_CHUNK_CONCURRENCY at a time),
+    their steps merged and deduplicated, and consolidated by one more LLM
+    call if there are still more than SOP_MAX_STEPS
+    """
+    semaphore = asyncio.Semaphore(SOP_CHUNK_CONCURRENCY)
+    
+    async def generate_chunk(index, chunk):
+        prompt = f"""Analyze part {index + 1} of {len(chunks)} of a longer document and create SOP steps:
+
+{chunk}  
+
+Create steps only for the procedure described in this part.
+Return ONLY the JSON array of steps."""
+        async with semaphore:
+            response = await send_prompt(system_message, prompt, use_cache=use_cache, on_step=on_step, priority=priority)
+        return load_steps(response)
+    
+    results = await asyncio.gather(
+        *(generate_chunk(index, chunk) for index, chunk in enumerate(chunks)),
+        return_exceptions=True
+    )
+    step_lists = [result for result in results if not isinstance(result, BaseException)]
+    if not step_lists:
+        raise results[0]
+    if len(step_lists) < len(results):
+        print(f"Warning: {len(results) - len(step_lists)} of {len(results)} chunks failed", file=sys.stderr)
+    
+    steps = merge_steps(step_lists)
+    if len(steps) <= SOP_MAX_STEPS:
+        return steps
+    
+    prompt = f"""These SOP steps were extracted from consecutive parts of one document:
+
+{json.dumps(steps)}
+
+Merge them into a single procedure of at most {SOP_MAX_STEPS} steps. Keep the original order,
+combine overlapping steps and keep all timings and references.
+Return ONLY the JSON array of steps."""
+    try:
+        return load_steps(await send_prompt(system_message, prompt, use_cache=use_cache, priority=priority))
+    except Exception as e:
+        print(f"Warning: could not consolidate steps: {e}", file=sys.stderr)
+        return steps
+
+async def generate_sop_steps(content, content_type, file_path=None, custom_prompt=None, use_cache=True, on_step=None, priority="normal"):
+    """
+    Use GPT-5 to generate SOP steps from content
+    Text longer than SOP_CHUNK_CHARS is split into chunks and generated map-reduce style
+    Identical requests are answered from the LLM response cache unless use_cache is False
+    on_step receives steps as they are generated, before chunk results are merged
+    priority orders the LLM calls against other requests in the process
+    """
+    system_message = build_system_message(custom_prompt)
     
     # Create prompt based on content type
     if content_type == 'image' and file_path:
@@ -143,99 +460,260 @@ The image contains: {content}
 
 Please create detailed SOP steps that describe the process shown in the image.
 Return ONLY the JSON array of steps."""
-    else:
-        prompt = f"""Analyze this document and create SOP steps:
+        return await send_prompt(system_message, prompt, file_path, use_cache=use_cache, on_step=on_step, priority=priority)
+    
+    if EXTRACT_MAX_CHARS:
+        content = content[:EXTRACT_MAX_CHARS]
+    
+    chunks = chunk_text(content) if len(content) > SOP_CHUNK_CHARS else [content]
+    if len(chunks) > 1:
+        steps = await generate_chunked_steps(chunks, system_message, use_cache, on_step, priority)
+        return json.dumps(steps)
+    
+    prompt = f"""Analyze this document and create SOP steps:
 
-{content[:8000]}  
+{content}  
 
 Please create detailed SOP steps based on this content.
 Return ONLY the JSON array of steps."""
+    return await send_prompt(system_message, prompt, use_cache=use_cache, on_step=on_step, priority=priority)
+
+def load_steps(response):
+    """Parse the JSON array of steps out of an LLM response, skipping malformed steps"""
+    return parse_step_array(response)
+
+def parse_steps(response):
+    """Parse the LLM response into a list of steps with IDs and order"""
+    steps = load_steps(response)
     
-    # Send message and get response
-    user_message = UserMessage(text=prompt)
-    response = await chat.send_message(user_message)
+    # Add IDs and order
+    for i, step in enumerate(steps):
+        step['id'] = f"step-{i+1}"
+        step['order'] = i + 1
     
-    return response
+    return steps
+
+def error_steps(error):
+    """Single placeholder step describing why processing failed"""
+    return [
+        {
+            "id": "step-1",
+            "order": 1,
+            "title": "Error processing document",
+            "description": f"Could not process the document: {str(error)}",
+            "timerSeconds": 0
+        }
+    ]
+
+async def process_file(file_path, mime_type, custom_prompt=None, on_progress=None, use_cache=True, on_step=None, priority="normal"):
+    """
+    Extract content from a file and generate SOP steps from it
+    on_progress, if given, is called with the stage name ("extracting", "generating")
+    on_step, if given, is called with each step as soon as it is generated
+    use_cache=False forces a fresh LLM call
+    priority ("high", "normal", "low") orders LLM calls in the shared scheduler
+    """
+    report = on_progress or (lambda stage: None)
+    
+    # Extract content (blocking parser work runs off the event loop)
+    report("extracting")
+    content, content_type = await asyncio.to_thread(extract_content_cached, file_path, mime_type)
+    
+    if not content or content.startswith("Error"):
+        raise Exception(content)
+    
+    # Generate SOP steps using GPT-5
+    report("generating")
+    response = await generate_sop_steps(
+        content, 
+        content_type, 
+        file_path if content_type == 'image' else None,
+        custom_prompt,
+        use_cache=use_cache,
+        on_step=on_step,
+        priority=priority
+    )
+    
+    return parse_steps(response)
+
+def read_manifest(manifest_path):
+    """
+    (file_path, mime_type) pairs from a manifest
+    .jsonl manifests hold {"file_path": ..., "mime_type": ...} objects, anything else one path per line
+    """
+    entries = []
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if manifest_path.endswith('.jsonl'):
+                entry = json.loads(line)
+                file_path, mime_type = entry['file_path'], entry.get('mime_type')
+            else:
+                file_path, mime_type = line, None
+            entries.append((os.path.join(base_dir, file_path), mime_type))
+    return entries
+
+def list_batch_files(source):
+    """(file_path, mime_type) pairs for a directory (recursive, hidden files skipped) or manifest"""
+    if os.path.isfile(source):
+        entries = read_manifest(source)
+    else:
+        entries = []
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            entries.extend((os.path.join(root, name), None) for name in sorted(files) if not name.startswith('.'))
+    
+    return [
+        (file_path, mime_type or mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+        for file_path, mime_type in entries
+    ]
+
+def read_checkpoint(output_path):
+    """Files already processed successfully according to an existing results file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Partial last line from an interrupted run
+                continue
+            if result.get('status') == 'ok':
+                done.add(result['file_path'])
+    return done
+
+async def process_batch_file(file_path, mime_type, custom_prompt, use_cache):
+    """Process one batch file into a result record with per-stage timings"""
+    started = time.perf_counter()
+    stage_started = {}
+    
+    def on_progress(stage):
+        stage_started[stage] = time.perf_counter()
+    
+    result = {"file_path": file_path, "mime_type": mime_type}
+    try:
+        steps = await process_file(file_path, mime_type, custom_prompt, on_progress=on_progress, use_cache=use_cache)
+        result.update(status="ok", steps=steps)
+    except Exception as e:
+        result.update(status="error", error=str(e))
+    finished = time.perf_counter()
+    
+    result["seconds"] = round(finished - started, 3)
+    if "generating" in stage_started:
+        result["extract_seconds"] = round(stage_started["generating"] - stage_started["extracting"], 3)
+        result["generate_seconds"] = round(finished - stage_started["generating"], 3)
+    return result
+
+async def run_batch(argv):
+    """
+    Batch mode: process every file of a directory or manifest into a JSON Lines file
+    Files already recorded as ok in the output are skipped, so an interrupted run resumes
+    """
+    parser = argparse.ArgumentParser(prog='process_document.py --batch')
+    parser.add_argument('source', help='Directory to process recursively, or a manifest file')
+    parser.add_argument('--output', required=True, help='JSON Lines results file, also used as the checkpoint')
+    parser.add_argument('--workers', type=int, default=4, help='Files processed concurrently')
+    parser.add_argument('--prompt-file', help='Custom prompt applied to every file')
+    parser.add_argument('--no-cache', action='store_true', help='Skip the LLM response cache')
+    args = parser.parse_args(argv)
+    
+    custom_prompt = None
+    if args.prompt_file:
+        with open(args.prompt_file, 'r', encoding='utf-8') as f:
+            custom_prompt = f.read()
+    
+    files = list_batch_files(args.source)
+    done = read_checkpoint(args.output)
+    pending = [(file_path, mime_type) for file_path, mime_type in files if file_path not in done]
+    print(f"{len(files)} files, {len(files) - len(pending)} already done, {len(pending)} to process", file=sys.stderr)
+    
+    queue = asyncio.Queue()
+    for entry in pending:
+        queue.put_nowait(entry)
+    counts = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+    
+    # Terminate a partial line left by an interrupted run
+    if os.path.exists(args.output) and os.path.getsize(args.output):
+        with open(args.output, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            partial_line = f.read(1) != b"\n"
+        if partial_line:
+            with open(args.output, 'a', encoding='utf-8') as output:
+                output.write("\n")
+    
+    with open(args.output, 'a', encoding='utf-8') as output:
+        async def worker():
+            while not queue.empty():
+                file_path, mime_type = queue.get_nowait()
+                result = await process_batch_file(file_path, mime_type, custom_prompt, not args.no_cache)
+                # One complete line per file, flushed so a crash loses at most in-flight files
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                counts[result["status"]] += 1
+                print(f"[{result['status']}] {file_path} ({result['seconds']}s)", file=sys.stderr)
+        
+        await asyncio.gather(*(worker() for _ in range(max(1, args.workers))))
+    
+    print(
+        f"Done in {time.perf_counter() - started:.1f}s: {counts['ok']} ok, {counts['error']} failed",
+        file=sys.stderr
+    )
+
+def emit_event(event):
+    """Write one streaming event as a JSON line, flushed so the reader sees it immediately"""
+    print(json.dumps(event), flush=True)
 
 async def main():
-    if len(sys.argv) < 3:
-        print(json.dumps({"error": "Usage: python process_document.py <file_path> <mime_type> [custom_prompt_file]"}))
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        await run_batch(sys.argv[2:])
+        return
+    
+    # --no-cache skips the LLM response cache
+    use_cache = '--no-cache' not in sys.argv
+    # --stream prints newline-delimited JSON events (progress, step, final) instead of one array
+    stream = '--stream' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ('--no-cache', '--stream')]
+    
+    if len(args) < 2:
+        print(json.dumps({"error": "Usage: python process_document.py <file_path> <mime_type> [custom_prompt_file] [--no-cache] [--stream] | --batch <dir|manifest> --output <results.jsonl>"}))
         sys.exit(1)
     
-    file_path = sys.argv[1]
-    mime_type = sys.argv[2]
-    custom_prompt_file = sys.argv[3] if len(sys.argv) > 3 else None
+    file_path = args[0]
+    mime_type = args[1]
+    custom_prompt_file = args[2] if len(args) > 2 else None
     
     try:
-        # Extract content
-        content, content_type = extract_content(file_path, mime_type)
-        
-        if not content or content.startswith("Error"):
-            raise Exception(content)
-        
         # Read custom prompt if provided
         custom_prompt = None
         if custom_prompt_file and os.path.exists(custom_prompt_file):
             with open(custom_prompt_file, 'r', encoding='utf-8') as f:
                 custom_prompt = f.read()
         
-        # Generate SOP steps using GPT-5
-        response = await generate_sop_steps(
-            content, 
-            content_type, 
-            file_path if content_type == 'image' else None,
-            custom_prompt
-        )
-        
-        # Try to parse as JSON
-        try:
-            # Clean response - remove markdown code blocks if present
-            cleaned_response = response.strip()
-            if cleaned_response.startswith('```'):
-                # Remove markdown code block markers
-                lines = cleaned_response.split('\n')
-                cleaned_response = '\n'.join(lines[1:-1] if len(lines) > 2 else lines)
-            
-            steps = json.loads(cleaned_response)
-            
-            # Validate structure
-            if not isinstance(steps, list):
-                raise Exception("Response is not a JSON array")
-            
-            # Add IDs and order
-            for i, step in enumerate(steps):
-                step['id'] = f"step-{i+1}"
-                step['order'] = i + 1
-                
+        if stream:
+            steps = await process_file(
+                file_path,
+                mime_type,
+                custom_prompt,
+                on_progress=lambda stage: emit_event({"type": "progress", "stage": stage}),
+                use_cache=use_cache,
+                on_step=lambda step: emit_event({"type": "step", "step": step})
+            )
+            emit_event({"type": "final", "steps": steps})
+        else:
+            steps = await process_file(file_path, mime_type, custom_prompt, use_cache=use_cache)
             print(json.dumps(steps))
-            
-        except json.JSONDecodeError as e:
-            # If JSON parsing fails, try to extract JSON from response
-            import re
-            json_match = re.search(r'\[.*\]', response, re.DOTALL)
-            if json_match:
-                steps = json.loads(json_match.group())
-                for i, step in enumerate(steps):
-                    step['id'] = f"step-{i+1}"
-                    step['order'] = i + 1
-                print(json.dumps(steps))
-            else:
-                raise Exception(f"Could not parse JSON from response: {response[:500]}")
         
     except Exception as e:
-        error_response = {
-            "error": str(e),
-            "steps": [
-                {
-                    "id": "step-1",
-                    "order": 1,
-                    "title": "Error processing document",
-                    "description": f"Could not process the document: {str(e)}",
-                    "timerSeconds": 0
-                }
-            ]
-        }
-        print(json.dumps(error_response.get("steps")))
+        if stream:
+            emit_event({"type": "final", "steps": error_steps(e), "error": str(e)})
+        else:
+            print(json.dumps(error_steps(e)))
         sys.exit(0)
 
 if __name__ == "__main__":
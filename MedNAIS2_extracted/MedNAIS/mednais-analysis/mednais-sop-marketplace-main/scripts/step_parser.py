@@ -0,0 +1,173 @@
+"""
+Incremental parser for the JSON array of SOP steps returned by the LLM
+
+The response can be fed in pieces as it arrives; every step object is parsed
+and validated as soon as its closing brace is seen. Text around the array
+(prose, markdown code fences) is skipped, and a malformed step or a cut-off
+tail only loses that step, not the ones before it.
+"""
+import json
+
+class StepValidationError(ValueError):
+    """A parsed object is not a usable step"""
+
+def validate_step(value):
+    """
+    Normalize a parsed object into a step, keeping only the SOPStep fields the LLM can fill
+    title is required; description defaults to "", timerSeconds must be a
+    non-negative whole number and references a list of strings
+
+    Raises:
+        StepValidationError: If the object can't be used as a step
+    """
+    if not isinstance(value, dict):
+        raise StepValidationError(f"Step is not an object: {value!r:.100}")
+
+    title = value.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise StepValidationError(f"Step has no title: {value!r:.100}")
+
+    step = {'title': title.strip()}
+
+    description = value.get('description')
+    step['description'] = description.strip() if isinstance(description, str) else ""
+
+    timer = value.get('timerSeconds')
+    if isinstance(timer, str) and timer.strip().isdigit():
+        timer = int(timer.strip())
+    if isinstance(timer, (int, float)) and not isinstance(timer, bool) and timer >= 0:
+        step['timerSeconds'] = int(timer)
+
+    references = value.get('references')
+    if isinstance(references, str):
+        references = [references]
+    if isinstance(references, list):
+        references = [str(reference).strip() for reference in references if reference not in (None, "")]
+        if references:
+            step['references'] = references
+
+    for field in ('question', 'youtubeUrl'):
+        if isinstance(value.get(field), str) and value[field].strip():
+            step[field] = value[field].strip()
+
+    return step
+
+class StepStreamParser:
+    """
+    Bracket-aware scanner that pulls step objects out of a JSON array
+
+    feed() returns the steps completed by the new text; steps and errors
+    accumulate on the parser. The array starts at the first "[" followed by
+    "{" or "]", so brackets in leading prose are ignored.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.errors = []
+        # Scanner state: before the array, inside it, or finished
+        self.state = 'search'
+        self.awaiting_array_body = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.current = []
+
+    @property
+    def done(self):
+        """True once the closing bracket of the array has been read"""
+        return self.state == 'done'
+
+    def feed(self, text):
+        """Consume more of the response; returns the steps it completed"""
+        completed = []
+        for char in text:
+            if self.state == 'search':
+                self._search(char)
+            elif self.state == 'array':
+                step = self._scan(char)
+                if step is not None:
+                    completed.append(step)
+            else:
+                break
+        return completed
+
+    def close(self):
+        """
+        Finish parsing; returns all steps found
+        An unterminated final object is recorded as an error
+        """
+        if self.current:
+            self.errors.append(f"Incomplete step at end of response: {''.join(self.current)[:100]}")
+            self.current = []
+        return self.steps
+
+    def _search(self, char):
+        if self.awaiting_array_body:
+            if char.isspace():
+                return
+            self.awaiting_array_body = False
+            if char == '{':
+                self.state = 'array'
+                self._scan(char)
+                return
+            if char == ']':
+                self.state = 'done'
+                return
+        if char == '[':
+            self.awaiting_array_body = True
+
+    def _scan(self, char):
+        if self.depth == 0:
+            # Between objects: only commas, whitespace and the closing bracket are expected
+            if char == '{':
+                self.depth = 1
+                self.current = [char]
+            elif char == ']':
+                self.state = 'done'
+            return None
+
+        self.current.append(char)
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+            return None
+
+        if char == '"':
+            self.in_string = True
+        elif char in '{[':
+            self.depth += 1
+        elif char in '}]':
+            self.depth -= 1
+            if self.depth == 0:
+                return self._finish_object()
+        return None
+
+    def _finish_object(self):
+        raw = "".join(self.current)
+        self.current = []
+        try:
+            step = validate_step(json.loads(raw))
+        except (ValueError, StepValidationError) as e:
+            self.errors.append(f"Skipped step: {e}")
+            return None
+        self.steps.append(step)
+        return step
+
+def parse_step_array(text):
+    """
+    Validated steps from a complete LLM response
+
+    Raises:
+        ValueError: If the response contains no usable step (an empty array is fine)
+    """
+    parser = StepStreamParser()
+    parser.feed(text)
+    steps = parser.close()
+    if not steps and (parser.errors or not parser.done):
+        detail = f" ({parser.errors[0]})" if parser.errors else ""
+        raise ValueError(f"Could not parse JSON from response{detail}: {text[:500]}")
+    return steps